@@ -0,0 +1,31 @@
+"""add users listing indexes
+
+Revision ID: b7d41f2c9a63
+Revises: 5c2e988d0019
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d41f2c9a63'
+down_revision: Union[str, Sequence[str], None] = '5c2e988d0019'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_users_created_at_user_id', 'users', ['created_at', 'user_id'], unique=False)
+    op.create_index('ix_users_user_role_id_created_at_user_id', 'users', ['user_role_id', 'created_at', 'user_id'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_user_role_id_created_at_user_id', table_name='users')
+    op.drop_index('ix_users_created_at_user_id', table_name='users')
@@ -0,0 +1,146 @@
+"""Per-request cost of building the use case dependency graph.
+
+Compares the former eager UnitOfWork (every DAL, service, mapper, PasswordHasher and JWT built per
+request, DB session created up front) with the lazy UnitOfWork and app-scoped components.
+The endpoint only resolves AuthCases, so neither variant touches Postgres or Redis.
+
+    python -m benchmarks.dependency_bench --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+
+for key, value in {
+    "DB_NAME": "auth_db", "DB_USER": "postgres", "POSTGRES_PASSWORD": "postgres", "DB_HOST": "localhost",
+    "DB_PORT": "5432", "REDIS_HOST": "localhost", "SECRET_KEY": "bench", "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "15", "REFRESH_TOKEN_EXPIRE_DAYS": "7",
+}.items():
+    os.environ.setdefault(key, value)
+
+import httpx
+from fastapi import Depends, FastAPI
+
+from src.auth.dals import UserDAL, RoleDAL, PermissionDAL, RedisDAL, SessionDAL
+from src.auth.db import async_session, init_redis, close_redis
+from src.auth.dependencies import get_auth_use_case, get_uow
+from src.auth.mappers import UserMapper, PayloadMapper, UserUpdateMapper
+from src.auth.service import UserService, RoleService, PermissionService, RedisService, SessionService
+from src.auth.use_cases import AuthCases
+from src.auth.utils import PasswordHasher, JWT
+
+
+class LegacyUnitOfWork:
+    def __init__(self, session, rd):
+        self.session = session
+        self.user_service = UserService(UserDAL(session))
+        self.role_service = RoleService(RoleDAL(session))
+        self.permission_service = PermissionService(PermissionDAL(session))
+        self.user_mapper = UserMapper
+        self.password_hasher = PasswordHasher()
+        self.payload_mapper = PayloadMapper()
+        self.redis_service = RedisService(RedisDAL(rd))
+        self.session_service = SessionService(SessionDAL(rd))
+        self.user_update_mapper = UserUpdateMapper()
+
+
+async def get_legacy_session():
+    session = async_session()
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+async def get_legacy_redis():
+    yield init_redis()
+
+
+async def get_legacy_uow(session=Depends(get_legacy_session), rd=Depends(get_legacy_redis)):
+    return LegacyUnitOfWork(session, rd)
+
+
+async def get_legacy_auth_use_case(uow: LegacyUnitOfWork = Depends(get_legacy_uow)) -> AuthCases:
+    return AuthCases(uow, uow.password_hasher, uow.user_mapper, JWT(), uow.payload_mapper)
+
+
+def build_app(dependency) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/noop")
+    async def noop(auth_use_cases: AuthCases = Depends(dependency)):
+        return {}
+
+    return app
+
+
+async def measure_latency(app: FastAPI, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(min(requests // 10, 200)):
+            await client.post("/noop")
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = await client.post("/noop")
+            assert response.status_code == 200, response.text
+        return (time.perf_counter() - started) / requests
+
+
+async def legacy_graph():
+    async for session in get_legacy_session():
+        await get_legacy_auth_use_case(LegacyUnitOfWork(session, init_redis()))
+
+
+async def lazy_graph():
+    async for uow in get_uow():
+        await get_auth_use_case(uow)
+
+
+async def measure_build(build, requests: int) -> float:
+    await build()
+    started = time.perf_counter()
+    for _ in range(requests):
+        await build()
+    return (time.perf_counter() - started) / requests
+
+
+async def measure_peak_memory(build, requests: int) -> float:
+    # пиковый прирост памяти за время сборки графа одного запроса
+    await build()
+    tracemalloc.start()
+    peaks = []
+    for _ in range(requests):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await build()
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return sum(peaks) / len(peaks)
+
+
+async def main(requests: int):
+    init_redis()
+    try:
+        rows = []
+        for name, dependency, build in (
+            ("eager UnitOfWork", get_legacy_auth_use_case, legacy_graph),
+            ("lazy UnitOfWork", get_auth_use_case, lazy_graph),
+        ):
+            build_time = await measure_build(build, requests)
+            allocated = await measure_peak_memory(build, min(requests, 1000))
+            latency = await measure_latency(build_app(dependency), requests)
+            rows.append((name, build_time, allocated, latency))
+    finally:
+        await close_redis()
+
+    print(f"{'graph':<20}{'build us':>10}{'peak bytes':>12}{'request us':>12}")
+    for name, build_time, allocated, latency in rows:
+        print(f"{name:<20}{build_time * 1e6:>10.1f}{allocated:>12.0f}{latency * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
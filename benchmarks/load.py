@@ -0,0 +1,352 @@
+"""Load test for /login, /login_from_refresh_token and protected endpoints.
+
+Drives src.main:app in-process through the ASGI transport (or a local uvicorn, the multi-worker
+src.server, or any URL),
+runs each scenario for a fixed time with N concurrent clients and reports RPS and p50/p95/p99.
+
+Postgres and Redis come from the environment (DB_*, REDIS_*) or are started as disposable
+containers (`docker`); Redis can also be a local `redis-server` without persistence or an in-process
+`fakeredis` server on a local port (`pip install fakeredis lupa`, no Redis binary needed). Load users
+are seeded into the DB_* database, which must be the one the target server uses.
+
+    python -m benchmarks.load --postgres docker --redis docker --duration 10 --concurrency 16
+    python -m benchmarks.load --target server --workers 4 --duration 10 --concurrency 64
+    python -m benchmarks.load --save-baseline benchmarks/load_baseline.json
+    python -m benchmarks.load --baseline benchmarks/load_baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+LOAD_ROLE = "loadtest"
+LOAD_PERMISSIONS = ("user:update", "user:logout", "role:list")
+LOAD_PASSWORD = "loadtest-password"
+
+DEFAULT_ENV = {
+    "DB_NAME": "auth_db", "DB_USER": "postgres", "POSTGRES_PASSWORD": "postgres", "DB_HOST": "localhost",
+    "DB_PORT": "5432", "REDIS_HOST": "localhost", "SECRET_KEY": "loadtest", "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "15", "REFRESH_TOKEN_EXPIRE_DAYS": "7",
+    # все виртуальные пользователи приходят с одного адреса и логинятся без пауз
+    "RATE_LIMIT_ENABLED": "false",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"port {port} did not open in {timeout}s")
+
+
+def start_container(stack: ExitStack, image: str, port: int, *args) -> int:
+    if shutil.which("docker") is None:
+        raise RuntimeError("docker is not available")
+    host_port = free_port()
+    container = subprocess.check_output(
+        ["docker", "run", "-d", "--rm", "-p", f"127.0.0.1:{host_port}:{port}", *args, image], text=True
+    ).strip()
+    stack.callback(subprocess.run, ["docker", "rm", "-f", container], capture_output=True)
+    wait_for_port(host_port)
+    return host_port
+
+
+def start_postgres(stack: ExitStack, mode: str) -> bool:
+    if mode == "env":
+        return False
+    password = os.environ["POSTGRES_PASSWORD"]
+    port = start_container(stack, "postgres:15-alpine", 5432,
+                           "-e", f"POSTGRES_PASSWORD={password}", "-e", f"POSTGRES_DB={os.environ['DB_NAME']}")
+    os.environ.update({"DB_HOST": "127.0.0.1", "DB_PORT": str(port), "DB_USER": "postgres"})
+    return True
+
+
+def start_fakeredis(stack: ExitStack) -> int:
+    # настоящий TCP-сервер в потоке харнесса: до него доходят и воркеры --target uvicorn/server
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        raise RuntimeError("fakeredis is not installed: pip install fakeredis lupa") from None
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stack.callback(server.server_close)
+    stack.callback(server.shutdown)
+    wait_for_port(port)
+    return port
+
+
+def start_redis(stack: ExitStack, mode: str):
+    if mode == "env":
+        return
+    if mode == "docker":
+        port = start_container(stack, "redis:7-alpine", 6379)
+    elif mode == "fakeredis":
+        port = start_fakeredis(stack)
+    else:
+        if shutil.which("redis-server") is None:
+            raise RuntimeError("redis-server is not available")
+        port = free_port()
+        process = subprocess.Popen(
+            ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"], stdout=subprocess.DEVNULL
+        )
+        stack.callback(process.terminate)
+        wait_for_port(port)
+    os.environ.update({"REDIS_HOST": "127.0.0.1", "REDIS_PORT": str(port)})
+
+
+def migrate(retries: int = 30):
+    # контейнер принимает соединения раньше, чем готов к запросам
+    for _ in range(retries):
+        result = subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT,
+                                capture_output=True, text=True)
+        if result.returncode == 0:
+            return
+        time.sleep(1)
+    raise RuntimeError(f"alembic upgrade failed:\n{result.stderr}")
+
+
+async def seed(users: int) -> list[str]:
+    from sqlalchemy import select
+    from sqlalchemy.dialects.postgresql import insert
+
+    from src.auth.db import async_session, dispose_engine
+    from src.auth.models import Permission, Role, User, role_permissions
+    from src.auth.utils import PasswordHasher
+
+    emails = [f"load{i}@loadtest.dev" for i in range(users)]
+    password_hash = await PasswordHasher().hash(LOAD_PASSWORD)
+    async with async_session() as session, session.begin():
+        await session.execute(insert(Role).values(role_id=uuid.uuid4(), name=LOAD_ROLE).on_conflict_do_nothing())
+        await session.execute(
+            insert(Permission)
+            .values([{"permission_id": uuid.uuid4(), "name": name} for name in LOAD_PERMISSIONS])
+            .on_conflict_do_nothing()
+        )
+        role_id = await session.scalar(select(Role.role_id).where(Role.name == LOAD_ROLE))
+        permission_ids = await session.scalars(select(Permission.permission_id).where(Permission.name.in_(LOAD_PERMISSIONS)))
+        await session.execute(
+            insert(role_permissions)
+            .values([{"role_id": role_id, "permission_id": permission_id} for permission_id in permission_ids])
+            .on_conflict_do_nothing()
+        )
+        await session.execute(
+            insert(User)
+            .values([{"user_id": uuid.uuid4(), "full_name": "Load Test User", "email": email,
+                      "password_hash": password_hash, "user_role_id": role_id} for email in emails])
+            .on_conflict_do_nothing()
+        )
+    await dispose_engine()
+    return emails
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, email: str):
+        self.client = client
+        self.email = email
+        self.cookies = {}
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        # cookie ставятся с secure, поэтому передаем их сами, чтобы работало и по http
+        headers = {"cookie": "; ".join(f"{key}={value}" for key, value in self.cookies.items())}
+        response = await self.client.request(method, path, headers=headers, **kwargs)
+        self.cookies.update(response.cookies)
+        self.client.cookies.clear()
+        return response
+
+    def login(self):
+        return self.request("POST", "/login", json={"email": self.email, "password": LOAD_PASSWORD})
+
+    def refresh(self):
+        return self.request("POST", "/login_from_refresh_token")
+
+    def list_roles(self):
+        return self.request("GET", "/roles", params={"limit": 20})
+
+    def update_user(self):
+        return self.request("PATCH", "/update_user", json={
+            "full_name": "Load Test User", "email": self.email, "user_role": LOAD_ROLE
+        })
+
+
+SCENARIOS = {
+    "POST /login": VirtualUser.login,
+    "POST /login_from_refresh_token": VirtualUser.refresh,
+    "GET /roles": VirtualUser.list_roles,
+    "PATCH /update_user": VirtualUser.update_user,
+}
+
+
+def percentile(values: list[float], q: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+async def run_scenario(users: list[VirtualUser], scenario, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(user: VirtualUser):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await scenario(user)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(user) for user in users))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run(client: httpx.AsyncClient, emails: list[str], duration: float) -> dict:
+    users = [VirtualUser(client, email) for email in emails]
+    for user in users:
+        response = await user.login()
+        response.raise_for_status()
+    return {name: await run_scenario(users, scenario, duration) for name, scenario in SCENARIOS.items()}
+
+
+async def run_asgi(emails: list[str], duration: float) -> dict:
+    from src.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            return await run(client, emails, duration)
+
+
+async def run_http(base_url: str, emails: list[str], duration: float) -> dict:
+    limits = httpx.Limits(max_connections=len(emails), max_keepalive_connections=len(emails))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        return await run(client, emails, duration)
+
+
+def start_uvicorn(stack: ExitStack) -> str:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port), "--log-level", "warning"], cwd=ROOT
+    )
+    stack.callback(process.terminate)
+    wait_for_port(port)
+    return f"http://127.0.0.1:{port}"
+
+
+def start_server(stack: ExitStack, workers: int) -> str:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.server", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=ROOT, env={**os.environ, "WEB_ACCESS_LOG": "false"}
+    )
+    stack.callback(process.wait)
+    stack.callback(process.terminate)
+    wait_for_port(port)
+    return f"http://127.0.0.1:{port}"
+
+
+def compare(results: dict, baseline: dict, tolerance: float, max_error_rate: float) -> list[str]:
+    failures = []
+    for name, result in results.items():
+        if result["requests"] and result["errors"] / result["requests"] > max_error_rate:
+            failures.append(f"{name}: error rate {result['errors']}/{result['requests']}")
+        if (base := baseline.get(name)) is None:
+            continue
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            failures.append(f"{name}: rps {result['rps']:.1f} < baseline {base['rps']:.1f}")
+        for key in ("p95", "p99"):
+            if result[key] > base[key] * (1 + tolerance):
+                failures.append(f"{name}: {key} {result[key]:.1f}ms > baseline {base[key]:.1f}ms")
+    return failures
+
+
+def report(results: dict):
+    print(f"{'endpoint':<34}{'requests':>9}{'errors':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, result in results.items():
+        print(f"{name:<34}{result['requests']:>9}{result['errors']:>8}{result['rps']:>9.1f}"
+              f"{result['p50']:>9.1f}{result['p95']:>9.1f}{result['p99']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", default="asgi", help="asgi, uvicorn, server or a base URL of a running server")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes for --target server, 0 - per core")
+    parser.add_argument("--postgres", choices=("env", "docker"), default="env")
+    parser.add_argument("--redis", choices=("env", "docker", "redis-server", "fakeredis"), default="env")
+    parser.add_argument("--migrate", action="store_true", help="run alembic upgrade head against the env database")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--baseline", type=Path, help="fail if results regress against this JSON file")
+    parser.add_argument("--save-baseline", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    for key, value in DEFAULT_ENV.items():
+        os.environ.setdefault(key, value)
+
+    with ExitStack() as stack:
+        if args.target in ("asgi", "uvicorn", "server"):
+            if start_postgres(stack, args.postgres) or args.migrate:
+                migrate()
+            start_redis(stack, args.redis)
+        # настройки читаются при импорте src.config, поэтому после запуска сервисов
+        emails = asyncio.run(seed(args.concurrency))
+
+        if args.target == "asgi":
+            results = asyncio.run(run_asgi(emails, args.duration))
+        else:
+            if args.target == "uvicorn":
+                base_url = start_uvicorn(stack)
+            elif args.target == "server":
+                base_url = start_server(stack, args.workers)
+            else:
+                base_url = args.target
+            results = asyncio.run(run_http(base_url, emails, args.duration))
+
+    report(results)
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=2))
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else {}
+    if failures := compare(results, baseline, args.tolerance, args.max_error_rate):
+        print("\nregressions:\n" + "\n".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
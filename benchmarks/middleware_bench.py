@@ -0,0 +1,94 @@
+"""Per-request overhead of the auth/error middleware on a protected endpoint.
+
+Compares the former pair of BaseHTTPMiddleware subclasses with AuthMiddleware.
+
+    python -m benchmarks.middleware_bench --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import time
+
+for key, value in {
+    "DB_NAME": "auth_db", "DB_USER": "postgres", "POSTGRES_PASSWORD": "postgres", "DB_HOST": "localhost",
+    "DB_PORT": "5432", "REDIS_HOST": "localhost", "SECRET_KEY": "bench", "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "15", "REFRESH_TOKEN_EXPIRE_DAYS": "7",
+}.items():
+    os.environ.setdefault(key, value)
+
+import httpx
+from fastapi import Depends, FastAPI
+from jose import jwt, JWTError
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from src.auth.dependencies import check_permission
+from src.auth.middleware import AuthMiddleware, exception_response
+from src.auth.utils import JWT
+from src.config import settings
+
+
+class LegacyJWTMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        public_paths = ["/docs", "/redoc", "/openapi.json", "/login", "/login_from_refresh_token", "/registration"]
+        if request.url.path in public_paths:
+            return await call_next(request)
+        token = request.cookies.get("access_token")
+        if not token:
+            return JSONResponse(status_code=401, content={"detail": "Token cookie required"})
+        try:
+            request.state.user = jwt.decode(token, str(settings.SECRET_KEY), algorithms=[settings.ALGORITHM])
+        except JWTError:
+            return JSONResponse(status_code=401, content={"detail": "Invalid or expired token"})
+        return await call_next(request)
+
+
+class LegacyExceptionMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        try:
+            return await call_next(request)
+        except Exception as exc:
+            return exception_response(exc)
+
+
+def build_app(middlewares) -> FastAPI:
+    app = FastAPI()
+    for middleware in middlewares:
+        app.add_middleware(middleware)
+
+    @app.patch("/update_user")
+    async def update_user(payload: dict = Depends(check_permission('user:update'))):
+        return {"user_id": payload["user_id"]}
+
+    return app
+
+
+async def measure(app: FastAPI, token: str, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies={"access_token": token}) as client:
+        for _ in range(min(requests // 10, 200)):
+            await client.patch("/update_user")
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = await client.patch("/update_user")
+            assert response.status_code == 200, response.text
+        return (time.perf_counter() - started) / requests
+
+
+async def main(requests: int):
+    token = JWT().create_access_token({"user_id": "bench", "permissions": ["user:update"]})
+    legacy = await measure(build_app([LegacyJWTMiddleware, LegacyExceptionMiddleware]), token, requests)
+    current = await measure(build_app([AuthMiddleware]), token, requests)
+
+    print(f"{'stack':<32}{'us/request':>12}")
+    print(f"{'BaseHTTPMiddleware x2':<32}{legacy * 1e6:>12.1f}")
+    print(f"{'AuthMiddleware':<32}{current * 1e6:>12.1f}")
+    print(f"saved per request: {(legacy - current) * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
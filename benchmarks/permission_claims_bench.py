@@ -0,0 +1,65 @@
+"""Access token size and decode + permission check cost: name list vs bitset claims.
+
+    python -m benchmarks.permission_claims_bench --iterations 2000
+"""
+import argparse
+import os
+import time
+
+for key, value in {
+    "DB_NAME": "auth_db", "DB_USER": "postgres", "POSTGRES_PASSWORD": "postgres", "DB_HOST": "localhost",
+    "DB_PORT": "5432", "REDIS_HOST": "localhost", "SECRET_KEY": "bench", "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "15", "REFRESH_TOKEN_EXPIRE_DAYS": "7",
+}.items():
+    os.environ.setdefault(key, value)
+
+from src.auth.cache import PermissionRegistry, decode_permission_bits
+from src.auth.mappers import PayloadMapper
+from src.auth.utils import JWT
+
+CATALOG_SIZE = 2000
+
+
+def make_tokens(jwt: JWT, registry: PermissionRegistry, size: int):
+    permissions = registry.names[:size]
+    legacy = jwt.create_access_token(PayloadMapper.to_entity('bench@example.com', 'role', 'user', permissions))
+    compact = jwt.create_access_token(
+        PayloadMapper.to_entity('bench@example.com', 'role', 'user', permissions, registry)
+    )
+    return legacy, compact, permissions[-1]
+
+
+def measure(check, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        assert check()
+    return (time.perf_counter() - started) / iterations
+
+
+def main(iterations: int):
+    jwt = JWT()
+    registry = PermissionRegistry(f"resource{i:04d}:action" for i in range(CATALOG_SIZE))
+
+    print(f"{'permissions':>12}{'list bytes':>12}{'bits bytes':>12}{'list us':>10}{'bits us':>10}")
+    for size in (10, 100, 1000):
+        legacy, compact, required = make_tokens(jwt, registry, size)
+
+        def check_list():
+            return required in jwt.decode_access_token(legacy)['permissions']
+
+        def check_bits():
+            payload = jwt.decode_access_token(compact)
+            # без кэша декодирования маски, как для первого запроса с токеном
+            decode_permission_bits.cache_clear()
+            return registry.has(payload['pb'], required)
+
+        list_time = measure(check_list, iterations)
+        bits_time = measure(check_bits, iterations)
+        print(f"{size:>12}{len(legacy):>12}{len(compact):>12}{list_time * 1e6:>10.1f}{bits_time * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.iterations)
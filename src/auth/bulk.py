@@ -0,0 +1,122 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = (CSV, NDJSON)
+MEDIA_TYPES = {CSV: 'text/csv', NDJSON: 'application/x-ndjson'}
+
+
+def detect_format(content_type: str | None, default: str = NDJSON) -> str:
+    if content_type and 'csv' in content_type:
+        return CSV
+    return default
+
+
+async def iter_lines(chunks):
+    # байты строк: декодирует iter_records, чтобы битая строка стала ошибкой этой строки
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.rstrip(b'\r')
+    if buffer:
+        yield buffer.rstrip(b'\r')
+
+
+async def iter_records(lines, fmt: str):
+    # (номер строки, dict | текст ошибки); запись CSV с переводом строки в кавычках
+    # занимает несколько строк и получает номер первой
+    header = None
+    line_no = 0
+    # строки CSV-записи, у которой поле в кавычках еще не закрыто
+    pending = []
+    quotes = 0
+    async for raw_line in lines:
+        line_no += 1
+        try:
+            line = raw_line.decode('utf-8')
+        except UnicodeDecodeError:
+            yield (line_no - len(pending) if pending else line_no), 'Invalid UTF-8'
+            pending, quotes = [], 0
+            continue
+        if not pending and not line.strip():
+            continue
+        if fmt == CSV:
+            pending.append(line)
+            # кавычки внутри поля удваиваются, поэтому нечетное число значит незакрытое поле
+            quotes += line.count('"')
+            if quotes % 2:
+                continue
+            record_line = line_no - len(pending) + 1
+            values = next(csv.reader([part + '\n' for part in pending]))
+            pending, quotes = [], 0
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            if len(values) != len(header):
+                yield record_line, f'Expected {len(header)} columns, got {len(values)}'
+                continue
+            yield record_line, dict(zip(header, values))
+        else:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as exc:
+                yield line_no, f'Invalid JSON: {exc.msg}'
+                continue
+            if not isinstance(record, dict):
+                yield line_no, 'Expected a JSON object'
+                continue
+            yield line_no, record
+    if pending:
+        yield line_no - len(pending) + 1, 'Unterminated quoted field'
+
+
+async def batched(records, size: int):
+    batch = []
+    async for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+async def encode_records(partitions, fmt: str, columns):
+    # один chunk на пачку курсора: следующая пачка читается только после отправки предыдущей
+    if fmt == CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        async for partition in partitions:
+            for row in partition:
+                writer.writerow([_csv_value(row[column]) for column in columns])
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    else:
+        async for partition in partitions:
+            yield ''.join(
+                json.dumps({column: row[column] for column in columns}, default=_json_default) + '\n'
+                for row in partition
+            ).encode()
@@ -0,0 +1,270 @@
+import base64
+import hashlib
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from src.config import settings
+
+
+class TokenCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._user_keys = {}
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str):
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        payload, expires_at = entry
+        if expires_at <= time.time():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def set(self, token: str, payload: dict):
+        if self.max_size <= 0:
+            return
+        expires_at = payload.get('exp')
+        if expires_at is None:
+            return
+
+        key = self._key(token)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (payload, float(expires_at))
+
+        user_id = payload.get('user_id')
+        if user_id is not None:
+            self._user_keys.setdefault(str(user_id), set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def evict_user(self, user_id):
+        for key in self._user_keys.pop(str(user_id), ()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._user_keys.clear()
+
+    def _remove(self, key: bytes):
+        payload, _ = self._entries.pop(key)
+        user_id = payload.get('user_id')
+        if user_id is not None:
+            keys = self._user_keys.get(str(user_id))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._user_keys[str(user_id)]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class RolePermissionCache:
+    def __init__(self):
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def get(self, role_id):
+        names = self._entries.get(str(role_id))
+        if names is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return names
+
+    def set(self, role_id, names, version: int):
+        # пока загружали из БД, кэш мог быть инвалидирован
+        if version == self.version:
+            self._entries[str(role_id)] = frozenset(names)
+
+    def invalidate(self, role_id=None):
+        self.version += 1
+        if role_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(str(role_id), None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'version': self.version,
+            'roles': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class NameCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def get(self, name: str):
+        entry = self._entries.get(name)
+        if entry is None or entry[1] <= time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def get_many(self, names) -> tuple[dict, set]:
+        found, missing = {}, set()
+        for name in names:
+            if (value := self.get(name)) is not None:
+                found[name] = value
+            else:
+                missing.add(name)
+        return found, missing
+
+    def set(self, name: str, value, version: int):
+        # отрицательные ответы не кэшируем: роль могут создать в любой момент
+        if value is not None and self.ttl > 0 and version == self.version:
+            self._entries[name] = (value, time.monotonic() + self.ttl)
+
+    def invalidate(self, name: str | None = None):
+        self.version += 1
+        if name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(name, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class RevocationList:
+    def __init__(self, prune_interval: float = 60.0):
+        self.prune_interval = prune_interval
+        self._entries = {}
+        self._next_prune = 0.0
+
+    def revoke(self, user_id, watermark: float, expires_at: float):
+        user_id = str(user_id)
+        current = self._entries.get(user_id)
+        if current is None or current[0] < watermark:
+            self._entries[user_id] = (watermark, expires_at)
+        token_cache.evict_user(user_id)
+        self.prune()
+
+    def is_revoked(self, user_id, issued_at) -> bool:
+        entry = self._entries.get(str(user_id))
+        return entry is not None and float(issued_at or 0) <= entry[0]
+
+    def prune(self, force: bool = False):
+        now = time.time()
+        if not force and now < self._next_prune:
+            return
+        self._next_prune = now + self.prune_interval
+        for user_id in [user_id for user_id, (_, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[user_id]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries)}
+
+
+@lru_cache(maxsize=4096)
+def decode_permission_bits(bits: str) -> int:
+    return int.from_bytes(base64.urlsafe_b64decode(bits + '=' * (-len(bits) % 4)), 'big')
+
+
+class PermissionRegistry:
+    def __init__(self, names):
+        self.names = tuple(sorted(set(names)))
+        self.index = {name: bit for bit, name in enumerate(self.names)}
+        self.version = hashlib.blake2b('\n'.join(self.names).encode(), digest_size=6).hexdigest()
+        # когда версия последний раз записана в Redis для других узлов
+        self.stored_at = None
+
+    def covers(self, names) -> bool:
+        return all(name in self.index for name in names)
+
+    def encode(self, names) -> str:
+        mask = 0
+        for name in names:
+            mask |= 1 << self.index[name]
+        raw = mask.to_bytes(max((mask.bit_length() + 7) // 8, 1), 'big')
+        return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+    def decode(self, bits: str):
+        mask = decode_permission_bits(bits)
+        return [name for bit, name in enumerate(self.names) if mask >> bit & 1]
+
+    def has(self, bits: str, name: str) -> bool:
+        bit = self.index.get(name)
+        return bit is not None and decode_permission_bits(bits) >> bit & 1 == 1
+
+
+class PermissionRegistryCache:
+    def __init__(self, keep_versions: int = 4):
+        self.keep_versions = keep_versions
+        self.current = None
+        self._versions = OrderedDict()
+
+    def get(self, version: str):
+        return self._versions.get(version)
+
+    def set(self, registry: PermissionRegistry):
+        self.current = registry
+        self.add(registry)
+
+    def add(self, registry: PermissionRegistry):
+        self._versions.pop(registry.version, None)
+        self._versions[registry.version] = registry
+        while len(self._versions) > self.keep_versions:
+            self._versions.popitem(last=False)
+
+    def invalidate(self):
+        # старые версии остаются, чтобы уже выданные токены продолжали проверяться
+        self.current = None
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE)
+revocation_list = RevocationList()
+permission_registry_cache = PermissionRegistryCache()
+role_permission_cache = RolePermissionCache()
+role_name_cache = NameCache(settings.NAME_CACHE_TTL)
+permission_name_cache = NameCache(settings.NAME_CACHE_TTL)
@@ -0,0 +1,55 @@
+import argparse
+import statistics
+import time
+
+from passlib.hash import bcrypt
+
+from src.config import settings
+
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+def measure(rounds: int, samples: int) -> float:
+    hasher = bcrypt.using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.hash('calibration-password')
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def calibrate(target: float, samples: int, min_rounds: int = MIN_ROUNDS, max_rounds: int = MAX_ROUNDS):
+    # каждый раунд удваивает время: идем вверх, пока укладываемся в цель
+    timings = {}
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings[rounds] = measure(rounds, samples)
+        if timings[rounds] > target:
+            break
+        chosen = rounds
+    return chosen, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pick BCRYPT_ROUNDS for a target hash latency on this machine')
+    parser.add_argument('--target-ms', type=float, default=250.0, help='latency of one hash on an idle worker')
+    parser.add_argument('--samples', type=int, default=3)
+    parser.add_argument('--min-rounds', type=int, default=MIN_ROUNDS)
+    parser.add_argument('--max-rounds', type=int, default=MAX_ROUNDS)
+    args = parser.parse_args()
+
+    chosen, timings = calibrate(args.target_ms / 1000, args.samples, args.min_rounds, args.max_rounds)
+    print(f"{'rounds':>6}{'ms':>10}")
+    for rounds, seconds in timings.items():
+        marker = '  <- chosen' if rounds == chosen else ''
+        print(f'{rounds:>6}{seconds * 1000:>10.1f}{marker}')
+    if timings[chosen] > args.target_ms / 1000:
+        print(f'even {chosen} rounds exceed the target, consider more hashing capacity')
+    print(f'\ncurrent BCRYPT_ROUNDS={settings.BCRYPT_ROUNDS}')
+    print(f'BCRYPT_ROUNDS={chosen}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,99 @@
-from sqlalchemy import select
+from sqlalchemy import select, func, tuple_, literal, union_all, update
+from sqlalchemy.dialects.postgresql import insert
 
+from src.auth.db import REPLICA
 from src.auth.models import User, Role, Permission, role_permissions
 
+REFRESH_TOKEN_PREFIX = "refresh_token:"
+USER_SESSIONS_PREFIX = "user_sessions:"
+RATE_LIMIT_PREFIX = "rate_limit:"
+
+IMPORT_USER_COLUMNS = ('user_id', 'full_name', 'email', 'password_hash', 'user_role_id')
+
+# ключи сессий одного пользователя с hash tag {user_id} - в одном слоте кластера
+# KEYS: refresh_token:{user_id}.<secret>, user_sessions:{user_id}
+# ARGV: token, user_id, ttl, now, max_sessions
+# возвращает вытесненные токены, их ключи удаляет вызывающий
+ADD_SESSION_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[4])
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('ZADD', KEYS[2], tonumber(ARGV[4]) + tonumber(ARGV[3]), ARGV[1])
+local evicted = {}
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[5])
+if excess > 0 then
+    evicted = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+end
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return evicted
+"""
+
+# KEYS: refresh_token:{user_id}.<old secret>, refresh_token:{user_id}.<new secret>, user_sessions:{user_id}
+# ARGV: old token, new token, user_id, ttl, now
+# токен действителен, только пока он есть в наборе сессий: ключ вытесненного мог еще не успеть удалиться
+ROTATE_SESSION_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[3] or not redis.call('ZSCORE', KEYS[3], ARGV[1]) then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[5])
+redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[4])
+redis.call('ZADD', KEYS[3], tonumber(ARGV[5]) + tonumber(ARGV[4]), ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return 1
+"""
+
+# KEYS: refresh_token:{user_id}.<secret>, user_sessions:{user_id}
+# ARGV: token, user_id
+REVOKE_SESSION_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return 1
+"""
+
+# KEYS: user_sessions:{user_id}
+# возвращает отозванные токены, их ключи удаляет вызывающий
+REVOKE_ALL_SESSIONS_SCRIPT = """
+local tokens = redis.call('ZRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+return tokens
+"""
+
+# KEYS: rate_limit:<scope>:<key>, ...
+# ARGV: now ms, window ms, member, limit for each key
+# попытка засчитывается во все окна, только если ни одно не переполнено; ответ - через сколько мс повторить
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= tonumber(ARGV[3 + i]) then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        retry_after = math.max(retry_after, tonumber(oldest[2]) + window - now)
+    end
+end
+if retry_after > 0 then
+    return retry_after
+end
+for _, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[3])
+    redis.call('PEXPIRE', key, window)
+end
+return 0
+"""
+
 
 class UserDAL:
     def __init__(self, session):
         self.session = session
 
     async def get_user_by_id(self, user_id):
+        # is_active для выдачи токенов читается с primary: реплика может не знать о деактивации
         return await self.session.get(User, user_id)
 
     async def create_user(self, **kwargs):
@@ -32,11 +118,74 @@ class UserDAL:
             await self.session.flush()
             return user
 
+    async def update_password_hash(self, user_id, old_hash: str, new_hash: str) -> bool:
+        # пароль могли сменить, пока считался новый хеш
+        stmt = (
+            update(User)
+            .where(User.user_id == user_id, User.password_hash == old_hash)
+            .values(password_hash=new_hash)
+            .returning(User.user_id)
+        )
+        result = await self.session.execute(stmt)
+        return result.scalar_one_or_none() is not None
+
     async def get_user_by_email(self, email: str):
         stmt = select(User).where(User.email == email)
         result = await self.session.execute(stmt)
         return result.scalar_one_or_none()
 
+    async def get_user_with_permission_names_by_email(self, email: str, replica: bool = True):
+        stmt = (
+            select(User, func.array_remove(func.array_agg(Permission.name), None))
+            .outerjoin(role_permissions, role_permissions.c.role_id == User.user_role_id)
+            .outerjoin(Permission, Permission.permission_id == role_permissions.c.permission_id)
+            .where(User.email == email)
+            .group_by(User.user_id)
+        )
+        result = await self.session.execute(stmt, execution_options=REPLICA if replica else {})
+        return result.one_or_none()
+
+    async def list_users(self, limit: int, after=None, role_name: str | None = None, is_active: bool | None = None):
+        stmt = select(User).order_by(User.created_at, User.user_id).limit(limit)
+        if after is not None:
+            stmt = stmt.where(tuple_(User.created_at, User.user_id) > tuple_(*after))
+        if role_name is not None:
+            stmt = stmt.where(User.user_role_id == select(Role.role_id).where(Role.name == role_name).scalar_subquery())
+        if is_active is not None:
+            stmt = stmt.where(User.is_active.is_(is_active))
+        result = await self.session.execute(stmt, execution_options=REPLICA)
+        return result.scalars().all()
+
+    async def stream_users(self, active_only: bool = False, role_name: str | None = None, batch_size: int = 1000):
+        # только колонки, без ORM-объектов: identity map не растет
+        stmt = (
+            select(User.user_id, User.full_name, User.email, User.is_active, User.created_at,
+                   Role.name.label('role'))
+            .outerjoin(Role, Role.role_id == User.user_role_id)
+            .order_by(User.created_at, User.user_id)
+            .execution_options(yield_per=batch_size)
+        )
+        if active_only:
+            stmt = stmt.where(User.is_active.is_(True))
+        if role_name is not None:
+            stmt = stmt.where(Role.name == role_name)
+        result = await self.session.stream(stmt, execution_options=REPLICA)
+        async for partition in result.mappings().partitions():
+            yield partition
+
+    async def copy_users(self, records) -> set[str]:
+        connection = await self.session.connection()
+        columns = ', '.join(IMPORT_USER_COLUMNS)
+        # COPY в промежуточную таблицу, чтобы существующие email не роняли всю пачку
+        await connection.exec_driver_sql('CREATE TEMP TABLE users_import (LIKE users INCLUDING DEFAULTS) ON COMMIT DROP')
+        raw = (await connection.get_raw_connection()).driver_connection
+        await raw.copy_records_to_table('users_import', records=records, columns=IMPORT_USER_COLUMNS)
+        result = await connection.exec_driver_sql(
+            f'INSERT INTO users ({columns}) SELECT {columns} FROM users_import '
+            f'ON CONFLICT (email) DO NOTHING RETURNING email'
+        )
+        return set(result.scalars())
+
 
 class RoleDAL:
     def __init__(self, session):
@@ -48,6 +197,11 @@ class RoleDAL:
         role = result.scalar_one_or_none()
         return role.role_id if role else None
 
+    async def get_role_ids_by_names(self, names):
+        stmt = select(Role.name, Role.role_id).where(Role.name.in_(names))
+        result = await self.session.execute(stmt)
+        return dict(result.all())
+
     async def get_role_by_id(self, role_id):
         return await self.session.get(Role, role_id)
 
@@ -83,6 +237,13 @@ class RoleDAL:
         result = await self.session.execute(stmt)
         return result.scalars().all()
 
+    async def list_roles(self, limit: int, after: str | None = None):
+        stmt = select(Role).order_by(Role.name).limit(limit)
+        if after is not None:
+            stmt = stmt.where(Role.name > after)
+        result = await self.session.execute(stmt, execution_options=REPLICA)
+        return result.scalars().all()
+
     async def assign_role_to_user(self, user_id, role_id):
         user = await self.session.get(User, user_id)
         if user:
@@ -139,6 +300,13 @@ class PermissionDAL:
         result = await self.session.execute(stmt)
         return result.scalars().all()
 
+    async def list_permissions(self, limit: int, after: str | None = None):
+        stmt = select(Permission).order_by(Permission.name).limit(limit)
+        if after is not None:
+            stmt = stmt.where(Permission.name > after)
+        result = await self.session.execute(stmt, execution_options=REPLICA)
+        return result.scalars().all()
+
     async def get_permissions_by_role(self, role_id):
         stmt = (
             select(Permission)
@@ -148,6 +316,14 @@ class PermissionDAL:
         result = await self.session.execute(stmt)
         return result.scalars().all()
 
+    async def get_all_role_permission_names(self):
+        stmt = (
+            select(role_permissions.c.role_id, Permission.name)
+            .join(Permission, Permission.permission_id == role_permissions.c.permission_id)
+        )
+        result = await self.session.execute(stmt)
+        return result.all()
+
     async def add_permission_to_role(self, role_id, permission_id):
         stmt = select(role_permissions).where(
             role_permissions.c.role_id == role_id,
@@ -166,6 +342,37 @@ class PermissionDAL:
             return permission_id, role_id
         return permission_id, role_id
 
+    async def get_role_and_permission_ids(self, role_names, permission_names):
+        stmt = union_all(
+            select(literal('role').label('kind'), Role.name, Role.role_id.label('id')).where(Role.name.in_(role_names)),
+            select(literal('permission'), Permission.name, Permission.permission_id)
+            .where(Permission.name.in_(permission_names)),
+        )
+        result = await self.session.execute(stmt)
+        ids = {'role': {}, 'permission': {}}
+        for kind, name, id_ in result:
+            ids[kind][name] = id_
+        return ids['role'], ids['permission']
+
+    async def add_permissions_to_roles(self, pairs) -> set[tuple]:
+        stmt = (
+            insert(role_permissions)
+            .values([{'role_id': role_id, 'permission_id': permission_id} for role_id, permission_id in pairs])
+            .on_conflict_do_nothing()
+            .returning(role_permissions.c.role_id, role_permissions.c.permission_id)
+        )
+        result = await self.session.execute(stmt)
+        return {tuple(row) for row in result}
+
+    async def remove_permissions_from_roles(self, pairs) -> set[tuple]:
+        stmt = (
+            role_permissions.delete()
+            .where(tuple_(role_permissions.c.role_id, role_permissions.c.permission_id).in_(list(pairs)))
+            .returning(role_permissions.c.role_id, role_permissions.c.permission_id)
+        )
+        result = await self.session.execute(stmt)
+        return {tuple(row) for row in result}
+
     async def remove_permission_from_role(self, role_id, permission_id):
         stmt = role_permissions.delete().where(
             role_permissions.c.role_id == role_id,
@@ -211,3 +418,83 @@ class RedisDAL:
 
     async def key_exists(self, key: str) -> bool:
         return await self.session.exists(key) == 1
+
+    async def publish(self, channel: str, message: str):
+        await self.session.publish(channel, message)
+
+    async def set_key_and_publish(self, key: str, value: str, expire_seconds: int, channel: str, message: str):
+        async with self.session.pipeline(transaction=True) as pipe:
+            pipe.setex(key, expire_seconds, value)
+            pipe.publish(channel, message)
+            await pipe.execute()
+
+    async def get_keys_with_ttl(self, pattern: str):
+        keys = [key async for key in self.session.scan_iter(match=pattern, count=1000)]
+        if not keys:
+            return []
+        async with self.session.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.get(key)
+                pipe.ttl(key)
+            values = await pipe.execute()
+        return [(key, values[i * 2], values[i * 2 + 1]) for i, key in enumerate(keys)]
+
+
+def user_sessions_key(user_id: str) -> str:
+    return f"{USER_SESSIONS_PREFIX}{{{user_id}}}"
+
+
+def refresh_token_key(token: str) -> str:
+    # токен - `<user_id>.<secret>`
+    user_id, _, secret = token.partition(".")
+    return f"{REFRESH_TOKEN_PREFIX}{{{user_id}}}.{secret}"
+
+
+class SessionDAL:
+    def __init__(self, session):
+        self.session = session
+        self._add_session = session.register_script(ADD_SESSION_SCRIPT)
+        self._rotate_session = session.register_script(ROTATE_SESSION_SCRIPT)
+        self._revoke_session = session.register_script(REVOKE_SESSION_SCRIPT)
+        self._revoke_all_sessions = session.register_script(REVOKE_ALL_SESSIONS_SCRIPT)
+
+    async def add_session(self, user_id: str, token: str, ttl: int, now: float, max_sessions: int):
+        evicted = await self._add_session(
+            keys=[refresh_token_key(token), user_sessions_key(user_id)],
+            args=[token, user_id, ttl, now, max_sessions],
+        )
+        await self._delete_tokens(evicted)
+
+    async def rotate_session(self, user_id: str, old_token: str, new_token: str, ttl: int, now: float) -> bool:
+        return await self._rotate_session(
+            keys=[refresh_token_key(old_token), refresh_token_key(new_token), user_sessions_key(user_id)],
+            args=[old_token, new_token, user_id, ttl, now],
+        ) == 1
+
+    async def revoke_session(self, user_id: str, token: str) -> bool:
+        return await self._revoke_session(
+            keys=[refresh_token_key(token), user_sessions_key(user_id)],
+            args=[token, user_id],
+        ) == 1
+
+    async def revoke_all_sessions(self, user_id: str) -> int:
+        tokens = await self._revoke_all_sessions(keys=[user_sessions_key(user_id)])
+        await self._delete_tokens(tokens)
+        return len(tokens)
+
+    async def _delete_tokens(self, tokens):
+        # ключи одного пользователя в одном слоте, поэтому один DEL
+        if tokens:
+            await self.session.delete(*(refresh_token_key(token) for token in tokens))
+
+
+class RateLimitDAL:
+    def __init__(self, session):
+        self.session = session
+        self._sliding_window = session.register_script(SLIDING_WINDOW_SCRIPT)
+
+    async def hit(self, limits: dict, now_ms: int, window_ms: int, member: str) -> int:
+        return await self._sliding_window(
+            keys=[RATE_LIMIT_PREFIX + key for key in limits],
+            args=[now_ms, window_ms, member, *limits.values()],
+        )
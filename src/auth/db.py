@@ -1,30 +1,270 @@
-from collections.abc import Generator
+import asyncio
+import itertools
+import logging
+import time
 
-from redis.asyncio import Redis
+from redis.asyncio import Redis, BlockingConnectionPool
+from redis.asyncio.client import Pipeline
+from sqlalchemy import AsyncAdaptedQueuePool, event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
+from src.auth.metrics import Histogram, count_db_statement, count_redis_round_trip, observe_db_query, \
+    observe_redis_command, registry
+from src.auth.profiling import record_query
 from src.config import settings
 
-engine = create_async_engine(settings.DATABASE_URL, future=True, echo=True)
+logger = logging.getLogger(__name__)
+
+# execution_options для чтений, которые можно отдать реплике
+REPLICA = {'replica': True}
+
+db_pool_wait = registry.register(Histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a database connection'))
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_wait.observe(time.perf_counter() - started)
+
+
+def create_engine(url: str):
+    engine = create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={
+            'statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+            'prepared_statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+        },
+    )
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+    return engine
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # только выражения: BEGIN/COMMIT asyncpg и pre-ping пула идут мимо курсора
+    count_db_statement()
+    conn.info['query_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    if started is not None:
+        duration = time.perf_counter() - started
+        observe_db_query(duration)
+        record_query(statement, parameters, duration)
+
+
+class ReplicaSet:
+    def __init__(self, engines, health_interval: float):
+        self.engines = list(engines)
+        self.health_interval = health_interval
+        self.healthy = list(self.engines)
+        self._counter = itertools.count()
+        self._task = None
+        for replica in self.engines:
+            event.listen(replica.sync_engine, 'handle_error', self._on_error)
+            event.listen(replica.sync_engine, 'do_connect', self._guard_connect(replica.sync_engine))
+
+    def choose(self):
+        # round-robin по живым репликам, None - читать с primary
+        healthy = self.healthy
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            self.mark_down(context.engine)
+
+    def _guard_connect(self, sync_engine):
+        # ошибки подключения до handle_error не доходят
+        def connect(dialect, conn_rec, cargs, cparams):
+            try:
+                return dialect.connect(*cargs, **cparams)
+            except Exception:
+                self.mark_down(sync_engine)
+                raise
+        return connect
+
+    def mark_down(self, sync_engine):
+        healthy = [replica for replica in self.healthy if replica.sync_engine is not sync_engine]
+        if len(healthy) != len(self.healthy):
+            logger.warning('replica %s is down, reads fall back to other replicas or primary', sync_engine.url)
+            self.healthy = healthy
+
+    async def check(self):
+        healthy = []
+        for replica in self.engines:
+            try:
+                async with replica.connect() as connection:
+                    await connection.exec_driver_sql('SELECT 1')
+            except Exception as exc:
+                logger.warning('replica %s failed health check: %r', replica.url, exc)
+                continue
+            healthy.append(replica)
+        self.healthy = healthy
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check()
+
+    def start(self):
+        if self.engines and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def dispose(self):
+        for replica in self.engines:
+            await replica.dispose()
+
+    def stats(self) -> dict:
+        return {
+            'configured': len(self.engines),
+            'healthy': len(self.healthy),
+        }
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, *, clause=None, replica=False, **kw):
+        if replica and not self.info.get('pinned'):
+            if (target := replicas.choose()) is not None:
+                return target.sync_engine
+        elif not getattr(clause, 'is_select', False):
+            # после записи сессия читает только с primary: реплика еще не видит изменений этой транзакции
+            self.info['pinned'] = True
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _route_reads(orm_execute_state):
+    if orm_execute_state.execution_options.get('replica'):
+        orm_execute_state.bind_arguments['replica'] = True
+
+
+engine = create_engine(settings.DATABASE_URL)
+replicas = ReplicaSet(
+    (create_engine(url) for url in settings.DB_REPLICA_URLS), settings.DB_REPLICA_HEALTH_INTERVAL
+)
 async_session = sessionmaker(
-    engine, expire_on_commit=False, class_=AsyncSession
+    engine, expire_on_commit=False, class_=AsyncSession, sync_session_class=RoutingSession
 )
 
 
-async def get_db_session() -> Generator:
-    try:
-        session: AsyncSession = async_session()
-        yield session
-    finally:
-        await session.close()
+def db_pool_stats() -> dict:
+    pool = engine.pool
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'idle': pool.checkedin(),
+        'overflow': pool.overflow(),
+        'checkout_wait': db_pool_wait.snapshot(),
+    }
+
+
+async def dispose_engine():
+    await engine.dispose()
+    await replicas.dispose()
+
+
+class CountingPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        count_redis_round_trip()
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            observe_redis_command('PIPELINE', time.perf_counter() - started)
 
 
-async def get_redis_connection():
-    try:
-        r = Redis(
-            host=settings.REDIS_HOST, port=6379, db=0, decode_responses=True
+class CountingRedis(Redis):
+    async def execute_command(self, *args, **options):
+        count_redis_round_trip()
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            observe_redis_command(str(args[0]).upper(), time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> Pipeline:
+        return CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+redis_pool: BlockingConnectionPool | None = None
+redis_client: Redis | None = None
+
+
+def init_redis() -> Redis:
+    global redis_pool, redis_client
+    if redis_client is None:
+        redis_pool = BlockingConnectionPool(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB,
+            decode_responses=True,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
         )
-        yield r
-    finally:
-        await r.close()
+        redis_client = CountingRedis(connection_pool=redis_pool)
+    return redis_client
+
+
+async def close_redis():
+    global redis_pool, redis_client
+    if redis_client is not None:
+        await redis_client.aclose()
+        await redis_pool.disconnect()
+        redis_pool = None
+        redis_client = None
+
+
+def redis_pool_stats() -> dict:
+    if redis_pool is None:
+        return {'max_connections': settings.REDIS_MAX_CONNECTIONS, 'in_use': 0, 'idle': 0}
+    return {
+        'max_connections': redis_pool.max_connections,
+        'in_use': len(redis_pool._in_use_connections),
+        'idle': len(redis_pool._available_connections),
+    }
+
+
+@registry.collector
+def collect_pool_metrics():
+    db_pool = db_pool_stats()
+    rd_pool = redis_pool_stats()
+    return [
+        ('db_pool_connections', 'gauge', 'Database pool connections by state', [
+            ({'state': 'checked_out'}, db_pool['checked_out']),
+            ({'state': 'idle'}, db_pool['idle']),
+            ({'state': 'overflow'}, max(db_pool['overflow'], 0)),
+        ]),
+        ('db_pool_size', 'gauge', 'Configured database pool size', [({}, db_pool['size'])]),
+        ('redis_pool_connections', 'gauge', 'Redis pool connections by state', [
+            ({'state': 'in_use'}, rd_pool['in_use']),
+            ({'state': 'idle'}, rd_pool['idle']),
+        ]),
+        ('redis_pool_max_connections', 'gauge', 'Configured Redis pool size', [({}, rd_pool['max_connections'])]),
+        ('db_replicas_healthy', 'gauge', 'Read replicas currently receiving reads', [({}, len(replicas.healthy))]),
+    ]
@@ -1,55 +1,128 @@
+import math
+from functools import cached_property
+
 from fastapi import Depends, HTTPException
-from redis.asyncio import Redis
-from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.requests import Request
 
-from src.auth.dals import UserDAL, RoleDAL, PermissionDAL, RedisDAL
-from src.auth.db import get_db_session, get_redis_connection
+from src.auth.dals import UserDAL, RoleDAL, PermissionDAL, RedisDAL, SessionDAL, RateLimitDAL
+from src.auth.cache import permission_registry_cache
+from src.auth.db import async_session, init_redis
+from src.auth.events import fetch_permission_registry
+from src.auth.permissions import PermissionMatcher, permission_matchers
+from src.auth.rate_limit import local_rate_limiter, redis_rate_limit_rejections
 from src.auth.mappers import UserMapper, PayloadMapper, UserUpdateMapper
-from src.auth.service import UserService, RoleService, PermissionService, RedisService
-from src.auth.use_cases import UserUseCases, RoleCases, PermissionCases, AuthCases
-from src.auth.utils import PasswordHasher, JWT
+from src.auth.service import UserService, RoleService, PermissionService, RedisService, SessionService, \
+    RateLimitService
+from src.auth.use_cases import UserUseCases, RoleCases, PermissionCases, AuthCases, UserExportCases
+from src.auth.utils import PasswordHasher, JWT, background_tasks
+from src.config import settings
+
+# без состояния, создаются один раз на процесс
+password_hasher = PasswordHasher()
+jwt = JWT()
+user_mapper = UserMapper()
+payload_mapper = PayloadMapper()
+user_update_mapper = UserUpdateMapper()
 
 
 class UnitOfWork:
-    def __init__(self, session: AsyncSession, rd):
-        self.session = session
-        self._users = UserDAL(session)
-        self._redis = RedisDAL(rd)
-        self._roles = RoleDAL(session)
-        self._permissions = PermissionDAL(session)
-        self.user_service = UserService(self._users)
-        self.role_service = RoleService(self._roles)
-        self.permission_service = PermissionService(self._permissions)
-        self.user_mapper = UserMapper
-        self.password_hasher = PasswordHasher()
-        self.payload_mapper = PayloadMapper()
-        self.redis_service = RedisService(self._redis)
-        self.user_update_mapper = UserUpdateMapper()
-
-
-async def get_uow(db: AsyncSession = Depends(get_db_session), rd: Redis = Depends(get_redis_connection)) -> UnitOfWork:
-    return UnitOfWork(db, rd)
+    # сессия и сервисы создаются при первом обращении: /logout не трогает Postgres
+    def __init__(self, session_factory=async_session, redis_factory=init_redis):
+        self._session_factory = session_factory
+        self._redis_factory = redis_factory
+
+    @cached_property
+    def session(self):
+        return self._session_factory()
+
+    @cached_property
+    def redis(self):
+        return self._redis_factory()
+
+    @cached_property
+    def user_service(self):
+        return UserService(UserDAL(self.session))
+
+    @cached_property
+    def role_service(self):
+        return RoleService(RoleDAL(self.session))
+
+    @cached_property
+    def permission_service(self):
+        return PermissionService(PermissionDAL(self.session))
+
+    @cached_property
+    def redis_service(self):
+        return RedisService(RedisDAL(self.redis))
+
+    @cached_property
+    def session_service(self):
+        return SessionService(SessionDAL(self.redis))
+
+    @cached_property
+    def rate_limit_service(self):
+        return RateLimitService(RateLimitDAL(self.redis))
+
+    async def close(self):
+        if 'session' in self.__dict__:
+            await self.session.close()
+
+
+async def get_uow():
+    uow = UnitOfWork()
+    try:
+        yield uow
+    finally:
+        await uow.close()
 
 
 async def get_user_use_case(uow: UnitOfWork = Depends(get_uow)) -> UserUseCases:
-    return UserUseCases(uow.user_service, uow.role_service, uow.permission_service, uow.password_hasher,
-                        uow.user_mapper, JWT(), uow.payload_mapper, uow.redis_service, uow.session,
-                        uow.user_update_mapper)
+    return UserUseCases(uow, password_hasher, user_mapper, jwt, payload_mapper, user_update_mapper)
+
+
+async def get_user_export_use_case() -> UserExportCases:
+    return UserExportCases(async_session, lambda session: UserService(UserDAL(session)))
 
 
 async def get_role_use_case(uow: UnitOfWork = Depends(get_uow)) -> RoleCases:
-    return RoleCases(uow.role_service, uow.session)
+    return RoleCases(uow)
 
 
 async def get_permission_use_case(uow: UnitOfWork = Depends(get_uow)) -> PermissionCases:
-    return PermissionCases(uow.role_service, uow.permission_service, uow.session)
+    return PermissionCases(uow)
 
 
 async def get_auth_use_case(uow: UnitOfWork = Depends(get_uow)) -> AuthCases:
-    return AuthCases(uow.user_service, uow.permission_service, uow.password_hasher,
-                     uow.user_mapper, JWT(), uow.payload_mapper, uow.redis_service, uow.session)
+    return AuthCases(uow, password_hasher, user_mapper, jwt, payload_mapper, UnitOfWork, background_tasks)
+
+
+async def get_permission_registry(version: str):
+    if registry := permission_registry_cache.get(version):
+        return registry
+    # токен выдан другим узлом или до перезапуска: версии каталога хранятся в Redis
+    if registry := await fetch_permission_registry(RedisService(RedisDAL(init_redis())), version):
+        return registry
+    async with async_session() as session:
+        registry = await PermissionService(PermissionDAL(session)).load_permission_registry()
+    if registry.version != version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token permissions are outdated"
+        )
+    return registry
+
+
+async def get_permission_matcher(user_data: dict) -> PermissionMatcher:
+    if 'pb' in user_data:
+        key = (user_data['pv'], user_data['pb'])
+        if matcher := permission_matchers.get(key):
+            return matcher
+        registry = await get_permission_registry(user_data['pv'])
+        return permission_matchers.compile(key, registry.decode(user_data['pb']))
+
+    permissions = tuple(user_data.get('permissions', ()))
+    return permission_matchers.get(permissions) or permission_matchers.compile(permissions, permissions)
 
 
 def check_permission(required_permission: str):
@@ -61,9 +134,11 @@ def check_permission(required_permission: str):
             )
 
         user_data = request.state.user
-        permissions = user_data.get('permissions', [])
 
-        if required_permission not in permissions:
+        if not hasattr(request.state, 'permissions'):
+            request.state.permissions = await get_permission_matcher(user_data)
+
+        if not request.state.permissions.allows(required_permission):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Permission '{required_permission}' required"
@@ -74,6 +149,37 @@ def check_permission(required_permission: str):
     return dependency
 
 
+def rate_limit(scope: str, ip_limit: int, email_limit: int):
+    # выполняется до валидации и хеширования: тело уже прочитано FastAPI, request.json() берет его из кэша
+    async def dependency(request: Request, uow: UnitOfWork = Depends(get_uow)):
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+
+        client = request.client.host if request.client else "unknown"
+        limits = {f"{scope}:ip:{client}": ip_limit}
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict) and isinstance(email := body.get("email"), str):
+            limits[f"{scope}:email:{email.strip().lower()}"] = email_limit
+
+        retry_after = local_rate_limiter.acquire_all(limits, settings.RATE_LIMIT_WINDOW)
+        if not retry_after:
+            retry_after = await uow.rate_limit_service.hit(limits, settings.RATE_LIMIT_WINDOW)
+            if retry_after:
+                redis_rate_limit_rejections.inc()
+
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts, try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+    return dependency
+
+
 async def get_refresh_token(request: Request):
     if refresh_token := request.cookies.get("refresh_token"):
         return refresh_token
@@ -81,3 +187,7 @@ async def get_refresh_token(request: Request):
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Not refresh token"
     )
+
+
+async def get_optional_refresh_token(request: Request):
+    return request.cookies.get("refresh_token")
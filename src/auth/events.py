@@ -0,0 +1,167 @@
+import asyncio
+import inspect
+import json
+import logging
+import time
+
+from redis.asyncio import Redis
+
+from src.auth.cache import role_permission_cache, revocation_list, permission_registry_cache, role_name_cache, \
+    permission_name_cache, PermissionRegistry
+from src.auth.dals import RedisDAL
+from src.auth.service import RedisService
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "auth:invalidate"
+REVOKED_USER_PREFIX = "revoked_user:"
+PERMISSION_REGISTRY_PREFIX = "permission_registry:"
+
+
+class InvalidationListener:
+    def __init__(self):
+        self._handlers = {}
+        self._on_connect = []
+        self._task = None
+
+    def register(self, kind: str, handler, on_connect=None):
+        self._handlers[kind] = handler
+        if on_connect is not None:
+            self._on_connect.append(on_connect)
+
+    def dispatch(self, message: str):
+        kind, _, value = message.partition(":")
+        if handler := self._handlers.get(kind):
+            handler(value)
+
+    async def _listen(self, redis: Redis):
+        while True:
+            try:
+                async with redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    # пока не были подписаны, сообщения могли потеряться
+                    for callback in self._on_connect:
+                        result = callback(redis)
+                        if inspect.isawaitable(result):
+                            await result
+                    # listen() ждет с socket_timeout и обрывает подписку, пока в канале тихо
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message is not None:
+                            self.dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("invalidation listener disconnected, reconnecting", exc_info=True)
+                await asyncio.sleep(1)
+
+    def start(self, redis: Redis):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen(redis))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def publish_invalidation(redis_service, kind: str, value: str = "*"):
+    await redis_service.publish(INVALIDATION_CHANNEL, f"{kind}:{value}")
+
+
+async def invalidate_role_permissions(redis_service, role_id=None):
+    role_permission_cache.invalidate(role_id)
+    await publish_invalidation(redis_service, "role_permissions", str(role_id) if role_id else "*")
+
+
+async def invalidate_permission_registry(redis_service):
+    permission_registry_cache.invalidate()
+    await publish_invalidation(redis_service, "permission_registry")
+
+
+async def invalidate_role_name(redis_service, name: str):
+    role_name_cache.invalidate(name)
+    await publish_invalidation(redis_service, "role_name", name)
+
+
+async def invalidate_permission_name(redis_service, name: str):
+    permission_name_cache.invalidate(name)
+    await publish_invalidation(redis_service, "permission_name", name)
+
+
+def access_token_lifetime() -> int:
+    return settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+
+async def store_permission_registry(redis_service, registry: PermissionRegistry):
+    # список прав версии живет в Redis дольше любого выданного с ней токена:
+    # ключ живет два срока токена и перезаписывается раз в срок
+    now = time.time()
+    if registry.stored_at is not None and now < registry.stored_at + access_token_lifetime():
+        return
+    await redis_service.set_key(
+        f"{PERMISSION_REGISTRY_PREFIX}{registry.version}", json.dumps(registry.names), 2 * access_token_lifetime()
+    )
+    registry.stored_at = now
+
+
+async def fetch_permission_registry(redis_service, version: str):
+    names = await redis_service.get_key(f"{PERMISSION_REGISTRY_PREFIX}{version}")
+    if names is None:
+        return None
+    registry = PermissionRegistry(json.loads(names))
+    if registry.version != version:
+        return None
+    permission_registry_cache.add(registry)
+    return registry
+
+
+async def revoke_access_tokens(redis_service, user_id):
+    watermark = time.time()
+    ttl = access_token_lifetime()
+    revocation_list.revoke(user_id, watermark, watermark + ttl)
+    await redis_service.set_key_and_publish(
+        f"{REVOKED_USER_PREFIX}{user_id}", str(watermark), ttl, INVALIDATION_CHANNEL, f"revoked:{user_id}:{watermark}"
+    )
+
+
+async def sync_revocations(redis: Redis):
+    now = time.time()
+    for key, watermark, ttl in await RedisService(RedisDAL(redis)).get_keys_with_ttl(f"{REVOKED_USER_PREFIX}*"):
+        if watermark is not None and ttl > 0:
+            revocation_list.revoke(key.removeprefix(REVOKED_USER_PREFIX), float(watermark), now + ttl)
+
+
+def _on_revoked(value: str):
+    user_id, _, watermark = value.partition(":")
+    watermark = float(watermark)
+    revocation_list.revoke(user_id, watermark, watermark + access_token_lifetime())
+
+
+invalidation_listener = InvalidationListener()
+invalidation_listener.register(
+    "role_permissions",
+    lambda value: role_permission_cache.invalidate(None if value == "*" else value),
+    on_connect=lambda redis: role_permission_cache.invalidate(),
+)
+invalidation_listener.register("revoked", _on_revoked, on_connect=sync_revocations)
+invalidation_listener.register(
+    "permission_registry",
+    lambda value: permission_registry_cache.invalidate(),
+    on_connect=lambda redis: permission_registry_cache.invalidate(),
+)
+invalidation_listener.register(
+    "role_name",
+    role_name_cache.invalidate,
+    on_connect=lambda redis: role_name_cache.invalidate(),
+)
+invalidation_listener.register(
+    "permission_name",
+    permission_name_cache.invalidate,
+    on_connect=lambda redis: permission_name_cache.invalidate(),
+)
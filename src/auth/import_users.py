@@ -0,0 +1,39 @@
+import argparse
+import asyncio
+import sys
+
+from src.auth.bulk import FORMATS, CSV, NDJSON, iter_lines, iter_records
+from src.auth.db import close_redis, dispose_engine
+from src.auth.dependencies import UnitOfWork, get_user_use_case
+from src.auth.utils import hashing_pool
+
+
+async def read_chunks(file, size: int = 1 << 16):
+    while chunk := await asyncio.to_thread(file.read, size):
+        yield chunk
+
+
+async def main(path: str, fmt: str, default_role: str | None):
+    uow = UnitOfWork()
+    try:
+        user_use_cases = await get_user_use_case(uow)
+        with open(path, 'rb') as file:
+            records = iter_records(iter_lines(read_chunks(file)), fmt)
+            report = await user_use_cases.import_users(records, default_role)
+    finally:
+        await uow.close()
+        await close_redis()
+        await dispose_engine()
+        hashing_pool.shutdown()
+    print(report.model_dump_json(indent=2))
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk user import from CSV or NDJSON')
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--role', help='role for rows without user_role')
+    args = parser.parse_args()
+    fmt = args.format or (CSV if args.path.endswith('.csv') else NDJSON)
+    sys.exit(asyncio.run(main(args.path, fmt, args.role)))
@@ -1,4 +1,4 @@
-from uuid import UUID
+from uuid import UUID, uuid4
 
 from src.auth.schemas import UserCreate, UserResponse, UserUpdate
 
@@ -13,6 +13,11 @@ class UserMapper:
             'password_hash': hashed_password
         }
 
+    @staticmethod
+    def to_record(user_create: UserCreate, role_id: UUID, hashed_password: str) -> tuple:
+        # порядок колонок IMPORT_USER_COLUMNS
+        return uuid4(), user_create.full_name, user_create.email, hashed_password, role_id
+
     @staticmethod
     def to_response(user_entity) -> UserResponse:
         return UserResponse.model_validate(user_entity)
@@ -33,13 +38,15 @@ class UserUpdateMapper:
 
 class PayloadMapper:
     @staticmethod
-    def to_entity(email, user_role_id, user_id, permissions) -> dict:
-        permissions_lst = []
-        for item in permissions:
-            permissions_lst.append(item.name)
-        return {
+    def to_entity(email, user_role_id, user_id, permissions, registry=None) -> dict:
+        entity = {
             'email': email,
             'user_id': user_id,
             'user_role_id': user_role_id,
-            'permissions': permissions_lst
         }
+        if registry is not None:
+            entity['pv'] = registry.version
+            entity['pb'] = registry.encode(permissions)
+        else:
+            entity['permissions'] = sorted(permissions)
+        return entity
@@ -0,0 +1,180 @@
+import bisect
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    # имя семейства передается вместе с суффиксом _total: HELP/TYPE и сэмпл называются одинаково
+    type = 'counter'
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def samples(self, labels: str = ''):
+        yield f'{self.name}{labels}', self.value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+        }
+
+    def samples(self, labels: str = ''):
+        prefix = labels[1:-1] + ',' if labels else ''
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.bucket_counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{{prefix}le="{bound}"}}', cumulative
+        yield f'{self.name}_sum{labels}', self.sum
+        yield f'{self.name}_count{labels}', self.count
+
+
+class LabeledHistogram:
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.children = {}
+
+    def labels(self, *values) -> Histogram:
+        # без блокировок: наблюдения идут только из потока event loop
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = Histogram(self.name, self.description, self.buckets)
+        return child
+
+    def samples(self, labels: str = ''):
+        for values, child in list(self.children.items()):
+            yield from child.samples(format_labels(zip(self.labelnames, values)))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        # collect() -> [(name, type, description, [(labels, value), ...]), ...], вызывается только при выгрузке
+        self.collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{name} {value}' for name, value in metric.samples())
+        for collect in self.collectors:
+            for name, metric_type, description, values in collect():
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                lines.extend(f'{name}{format_labels(labels.items())} {value}' for labels, value in values)
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels) -> str:
+    pairs = ','.join(f'{key}="{escape_label(str(value))}"' for key, value in labels)
+    return f'{{{pairs}}}' if pairs else ''
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class RequestStats:
+    __slots__ = ('db_statements', 'db_time', 'redis_round_trips', 'redis_time', 'statements')
+
+    def __init__(self):
+        self.db_statements = 0
+        self.db_time = 0.0
+        # (use case, statement) -> сколько раз выполнен, заполняется при SQL_PROFILING
+        self.statements = {}
+        self.redis_round_trips = 0
+        self.redis_time = 0.0
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+
+def count_db_statement():
+    if (stats := request_stats.get()) is not None:
+        stats.db_statements += 1
+
+
+def count_redis_round_trip():
+    if (stats := request_stats.get()) is not None:
+        stats.redis_round_trips += 1
+
+
+def observe_db_query(duration: float):
+    db_query_duration.observe(duration)
+    if (stats := request_stats.get()) is not None:
+        stats.db_time += duration
+
+
+def observe_redis_command(command: str, duration: float):
+    redis_command_duration.labels(command).observe(duration)
+    if (stats := request_stats.get()) is not None:
+        stats.redis_time += duration
+
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+request_duration = registry.register(LabeledHistogram(
+    'http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status'), REQUEST_BUCKETS
+))
+request_db_queries = registry.register(Histogram(
+    'http_request_db_queries', 'SQL statements executed per request', COUNT_BUCKETS
+))
+request_db_time = registry.register(Histogram(
+    'http_request_db_seconds', 'Time spent in SQL statements per request', REQUEST_BUCKETS
+))
+request_redis_commands = registry.register(Histogram(
+    'http_request_redis_commands', 'Redis round trips per request', COUNT_BUCKETS
+))
+db_query_duration = registry.register(Histogram(
+    'db_query_duration_seconds', 'SQL statement latency', FAST_BUCKETS
+))
+redis_command_duration = registry.register(LabeledHistogram(
+    'redis_command_duration_seconds', 'Redis command latency', ('command',), FAST_BUCKETS
+))
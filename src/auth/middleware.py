@@ -1,107 +1,149 @@
+import time
 from http import HTTPStatus
-from jose import jwt, JWTError
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+
+from jose import JWTError
+from starlette.requests import HTTPConnection
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 
+from src.auth.cache import token_cache, revocation_list
+from src.auth.metrics import RequestStats, request_stats, request_duration, request_db_queries, request_db_time, \
+    request_redis_commands
+from src.auth.profiling import report_request
+from src.auth.utils import JWT
 from src.config import settings
 
 DEBUG = False
 
+PUBLIC_PATHS = frozenset({"/docs", "/redoc", "/openapi.json", "/login", "/login_from_refresh_token", "/registration",
+                          "/health", "/metrics", "/.well-known/jwks.json"})
 
-class JWTMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-
-        public_paths = ["/docs", "/redoc", "/openapi.json", "/login", "/login_from_refresh_token", "/registration"]
-
-        if DEBUG:
-            return await call_next(request)
+EXCEPTION_RESPONSES = (
+    (LookupError, HTTPStatus.NOT_FOUND, "Not Found", "The requested resource was not found"),
+    (PermissionError, HTTPStatus.FORBIDDEN, "Forbidden", "Insufficient permissions to access this resource"),
+    (ValueError, HTTPStatus.BAD_REQUEST, "Bad Request", "Invalid input data or validation error"),
+    (RuntimeError, HTTPStatus.UNPROCESSABLE_ENTITY, "Unprocessable Entity", "The operation could not be completed"),
+)
 
-        if request.url.path in public_paths:
-            return await call_next(request)
-
-        token = request.cookies.get("access_token")
-
-        if not token:
-            return JSONResponse(
-                status_code=401,
-                content={"detail": "Token cookie required"}
-            )
 
-        try:
-            payload = jwt.decode(token, str(settings.SECRET_KEY), algorithms=[settings.ALGORITHM])
-            request.state.user = payload
-        except JWTError:
+def exception_response(exc: Exception) -> JSONResponse:
+    for exc_type, status_code, error, detail in EXCEPTION_RESPONSES:
+        if isinstance(exc, exc_type):
             return JSONResponse(
-                status_code=401,
-                content={"detail": "Invalid or expired token"}
-            )
-
-        return await call_next(request)
-
-
-class ExceptionMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        try:
-            response = await call_next(request)
-            return response
-
-        except LookupError as exc:
-            return JSONResponse(
-                status_code=HTTPStatus.NOT_FOUND,
+                status_code=status_code,
                 content={
-                    "error": "Not Found",
+                    "error": error,
                     "message": str(exc),
-                    "detail": "The requested resource was not found"
+                    "detail": detail
                 }
             )
 
-        except PermissionError as exc:
-            return JSONResponse(
-                status_code=HTTPStatus.FORBIDDEN,
-                content={
-                    "error": "Forbidden",
-                    "message": str(exc),
-                    "detail": "Insufficient permissions to access this resource"
-                }
-            )
-
-        except ValueError as exc:
-            return JSONResponse(
-                status_code=HTTPStatus.BAD_REQUEST,
-                content={
-                    "error": "Bad Request",
-                    "message": str(exc),
-                    "detail": "Invalid input data or validation error"
-                }
-            )
-
-        except RuntimeError as exc:
-            return JSONResponse(
-                status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
-                content={
-                    "error": "Unprocessable Entity",
-                    "message": str(exc),
-                    "detail": "The operation could not be completed"
-                }
-            )
-
-        except KeyError as exc:
-            return JSONResponse(
-                status_code=HTTPStatus.NOT_FOUND,
-                content={
-                    "error": "Not Found",
-                    "message": str(exc),
-                    "detail": "The requested key was not found"
-                }
-            )
+    return JSONResponse(
+        status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+        content={
+            "error": "Internal Server Error",
+            "message": "An unexpected error occurred",
+            "detail": str(exc) if str(exc) else "Unknown error"
+        }
+    )
+
+
+class AuthMiddleware:
+    def __init__(self, app: ASGIApp, public_paths=PUBLIC_PATHS):
+        self.app = app
+        self.public_paths = frozenset(public_paths)
+        self.jwt = JWT()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if not DEBUG and scope["path"] not in self.public_paths:
+            token = HTTPConnection(scope).cookies.get("access_token")
+
+            if not token:
+                response = JSONResponse(
+                    status_code=401,
+                    content={"detail": "Token cookie required"}
+                )
+                await response(scope, receive, send)
+                return
+
+            payload = token_cache.get(token)
+            if payload is None:
+                try:
+                    payload = self.jwt.decode_access_token(token)
+                except JWTError:
+                    response = JSONResponse(
+                        status_code=401,
+                        content={"detail": "Invalid or expired token"}
+                    )
+                    await response(scope, receive, send)
+                    return
+                token_cache.set(token, payload)
+
+            if revocation_list.is_revoked(payload.get("user_id"), payload.get("iat")):
+                response = JSONResponse(
+                    status_code=401,
+                    content={"detail": "Invalid or expired token"}
+                )
+                await response(scope, receive, send)
+                return
+
+            scope.setdefault("state", {})["user"] = payload
+
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
 
+        try:
+            await self.app(scope, receive, send_wrapper)
         except Exception as exc:
-            return JSONResponse(
-                status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
-                content={
-                    "error": "Internal Server Error",
-                    "message": "An unexpected error occurred",
-                    "detail": str(exc) if str(exc) else "Unknown error"
-                }
-            )
+            if response_started:
+                raise
+            await exception_response(exc)(scope, receive, send_wrapper)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+        stats = RequestStats()
+        stats_token = request_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.DEBUG:
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"x-db-statements", str(stats.db_statements).encode()),
+                        (b"x-redis-round-trips", str(stats.redis_round_trips).encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_stats.reset(stats_token)
+            # шаблон пути, а не сам путь: иначе id в URL раздувают число рядов
+            route = scope.get("route")
+            route = route.path if route is not None else "<unmatched>"
+            request_duration.labels(scope["method"], route, str(status_code)).observe(time.perf_counter() - started)
+            request_db_queries.observe(stats.db_statements)
+            request_db_time.observe(stats.db_time)
+            request_redis_commands.observe(stats.redis_round_trips)
+            report_request(stats, scope["method"], route)
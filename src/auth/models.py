@@ -9,7 +9,7 @@ from sqlalchemy import (
     ForeignKey,
     String,
     Table,
-    func, Text, UniqueConstraint,
+    func, Text, UniqueConstraint, Index,
 )
 from sqlalchemy.orm import declarative_base, relationship
 
@@ -42,6 +42,12 @@ class User(Base):
 
     user_role = relationship("Role", back_populates="users", foreign_keys=[user_role_id])
 
+    __table_args__ = (
+        # keyset-пагинация списка пользователей, в том числе с фильтром по роли
+        Index('ix_users_created_at_user_id', 'created_at', 'user_id'),
+        Index('ix_users_user_role_id_created_at_user_id', 'user_role_id', 'created_at', 'user_id'),
+    )
+
     def check_password(self, password):
         return bcrypt.verify(password, self.password_hash)
 
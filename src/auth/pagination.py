@@ -0,0 +1,44 @@
+import base64
+import json
+from datetime import datetime
+from uuid import UUID
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def decode_user_cursor(cursor: str) -> tuple[datetime, UUID]:
+    values = decode_cursor(cursor)
+    try:
+        created_at, user_id = values
+        return datetime.fromisoformat(created_at), UUID(user_id)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def decode_name_cursor(cursor: str) -> str:
+    values = decode_cursor(cursor)
+    if len(values) != 1 or not isinstance(values[0], str):
+        raise ValueError('Invalid cursor')
+    return values[0]
+
+
+def paginate(rows, limit: int, cursor_values) -> tuple[list, str | None]:
+    # DAL запрашивает limit + 1 строку, лишняя означает, что есть следующая страница
+    rows = list(rows)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(*cursor_values(rows[-1]))
+    return rows, None
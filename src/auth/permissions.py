@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+SEPARATOR = ':'
+WILDCARD = '*'
+
+
+class PermissionMatcher:
+    def __init__(self, names):
+        self.exact = frozenset(names)
+        # узел trie: {сегмент: узел}, ключ None отмечает выданное право
+        self.trie = {}
+        for name in self.exact:
+            node = self.trie
+            for segment in name.split(SEPARATOR):
+                node = node.setdefault(segment, {})
+            node[None] = True
+        self._results = {}
+
+    def allows(self, required: str) -> bool:
+        if required in self.exact:
+            return True
+        result = self._results.get(required)
+        if result is None:
+            result = self._results[required] = self._match(self.trie, required.split(SEPARATOR), 0)
+        return result
+
+    def _match(self, node: dict, segments: list, position: int) -> bool:
+        # имя без шаблона выдает только само себя: иерархия включается явным `user:*`
+        if position == len(segments):
+            return None in node
+        wildcard = node.get(WILDCARD)
+        # завершающий `*` покрывает все вложенные права, в середине - один сегмент
+        if wildcard is not None and (None in wildcard or self._match(wildcard, segments, position + 1)):
+            return True
+        child = node.get(segments[position])
+        return child is not None and self._match(child, segments, position + 1)
+
+
+class PermissionMatcherCache:
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        matcher = self._entries.get(key)
+        if matcher is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return matcher
+
+    def compile(self, key, names) -> PermissionMatcher:
+        matcher = self._entries[key] = PermissionMatcher(names)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return matcher
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+permission_matchers = PermissionMatcherCache()
@@ -0,0 +1,111 @@
+import functools
+import inspect
+import logging
+import random
+import re
+from contextvars import ContextVar
+
+from src.auth.metrics import LabeledHistogram, registry, request_stats
+from src.config import settings
+
+logger = logging.getLogger('src.auth.sql')
+
+current_use_case: ContextVar[str | None] = ContextVar('current_use_case', default=None)
+
+NO_USE_CASE = '<none>'
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+WHITESPACE = re.compile(r'\s+')
+
+use_case_query_duration = registry.register(LabeledHistogram(
+    'db_use_case_query_seconds', 'SQL statement latency by use case', ('use_case',),
+    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+))
+
+
+def profile_use_cases(cls):
+    # каждый публичный метод помечает свои запросы меткой `Класс.метод`
+    for name, method in list(vars(cls).items()):
+        if not name.startswith('_') and (inspect.iscoroutinefunction(method) or inspect.isasyncgenfunction(method)):
+            setattr(cls, name, use_case(f'{cls.__name__}.{name}')(method))
+    return cls
+
+
+def use_case(label: str):
+    def decorator(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                # метка ставится на каждый шаг, а не через yield: генератор могут
+                # дочитать или закрыть из другого контекста (обрыв клиента, финализатор)
+                generator = fn(*args, **kwargs)
+                try:
+                    while True:
+                        token = current_use_case.set(label)
+                        try:
+                            item = await generator.__anext__()
+                        except StopAsyncIteration:
+                            return
+                        finally:
+                            current_use_case.reset(token)
+                        yield item
+                finally:
+                    token = current_use_case.set(label)
+                    try:
+                        await generator.aclose()
+                    finally:
+                        current_use_case.reset(token)
+        else:
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                token = current_use_case.set(label)
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    current_use_case.reset(token)
+        return wrapper
+    return decorator
+
+
+def normalize(statement: str) -> str:
+    return WHITESPACE.sub(' ', STRING_LITERAL.sub("'?'", statement)).strip()
+
+
+def redact(parameters) -> str:
+    # в лог попадают только типы значений: в параметрах бывают email, хеши паролей и токены
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: <{type(value).__name__}>' for key, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f'[{len(parameters)} x {redact(parameters[0])}]'
+        return '(' + ', '.join(f'<{type(value).__name__}>' for value in parameters) + ')'
+    return f'<{type(parameters).__name__}>'
+
+
+def record_query(statement: str, parameters, duration: float):
+    label = current_use_case.get() or NO_USE_CASE
+    use_case_query_duration.labels(label).observe(duration)
+
+    if settings.SQL_PROFILING and (stats := request_stats.get()) is not None:
+        key = (label, statement)
+        stats.statements[key] = stats.statements.get(key, 0) + 1
+
+    if duration * 1000 >= settings.SQL_SLOW_QUERY_MS and random.random() < settings.SQL_SLOW_QUERY_SAMPLE_RATE:
+        logger.warning(
+            'slow query %.1fms in %s: %s params=%s',
+            duration * 1000, label, normalize(statement), redact(parameters),
+        )
+
+
+def report_request(stats, method: str, route: str):
+    if not settings.SQL_PROFILING or not stats.db_statements:
+        return
+    logger.info(
+        '%s %s: %d SQL statements, %.1fms in SQL',
+        method, route, stats.db_statements, stats.db_time * 1000,
+    )
+    for (label, statement), count in stats.statements.items():
+        if count >= settings.SQL_N_PLUS_ONE_THRESHOLD:
+            logger.warning(
+                'possible N+1 in %s %s (%s): %d identical statements: %s',
+                method, route, label, count, normalize(statement),
+            )
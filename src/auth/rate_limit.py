@@ -0,0 +1,55 @@
+import time
+from collections import OrderedDict
+
+from src.auth.metrics import Counter, registry
+from src.config import settings
+
+
+class TokenBucketLimiter:
+    # локальный предфильтр: то, что уже превысило лимит на этом процессе, в Redis не ходит
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = OrderedDict()
+
+    def acquire(self, key: str, limit: int, window: int, now: float | None = None) -> float:
+        now = time.monotonic() if now is None else now
+        rate = limit / window
+        tokens, updated = self._buckets.pop(key, (limit, now))
+        tokens = min(limit, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self._store(key, tokens, now)
+            self.rejected += 1
+            return (1 - tokens) / rate
+        self._store(key, tokens - 1, now)
+        self.allowed += 1
+        return 0.0
+
+    def acquire_all(self, limits: dict, window: int) -> float:
+        now = time.monotonic()
+        retry_after = 0.0
+        for key, limit in limits.items():
+            retry_after = max(retry_after, self.acquire(key, limit, window, now))
+        return retry_after
+
+    def _store(self, key: str, tokens: float, now: float):
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def clear(self):
+        self._buckets.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._buckets),
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+        }
+
+
+local_rate_limiter = TokenBucketLimiter(settings.RATE_LIMIT_LOCAL_KEYS)
+redis_rate_limit_rejections = registry.register(Counter(
+    'rate_limit_redis_rejected_total', 'Attempts rejected by the shared sliding window'
+))
@@ -1,8 +1,13 @@
 import re
 
-from pydantic import BaseModel, ConfigDict, field_validator, model_validator
+from datetime import datetime
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
 from uuid import UUID
 
+T = TypeVar('T')
+
 
 class Login(BaseModel):
     email: str
@@ -105,6 +110,20 @@ class AddPermissionToRole(BaseModel):
     role_name: str
 
 
+class RolePermissionPair(BaseModel):
+    role_name: str
+    permission_name: str
+
+
+class RolePermissionPairs(BaseModel):
+    pairs: list[RolePermissionPair] = Field(min_length=1, max_length=5000)
+
+
+class RolePermissionPairsResult(BaseModel):
+    changed: list[RolePermissionPair]
+    unchanged: list[RolePermissionPair]
+
+
 class DeletePermissionFromRole(BaseModel):
     permission_name: str
     role_name: str
@@ -145,3 +164,44 @@ class UserResponse(BaseModel):
     is_active: bool
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class UserImport(UserCreate):
+    password_repeat: str | None = None
+    user_role: str | None = None
+
+    @model_validator(mode='before')
+    @classmethod
+    def default_password_repeat(cls, data):
+        if isinstance(data, dict) and data.get('password_repeat') is None:
+            data = {**data, 'password_repeat': data.get('password')}
+        return data
+
+    @field_validator('full_name', 'email')
+    def validate_length(cls, v):
+        # ограничение колонок String(50)
+        if len(v) > 50:
+            raise ValueError('Value must be at most 50 characters long.')
+        return v
+
+
+class ImportRowError(BaseModel):
+    line: int
+    email: str | None = None
+    error: str
+
+
+class ImportReport(BaseModel):
+    created: int = 0
+    failed: int = 0
+    errors: list[ImportRowError] = []
+
+
+class UserListItem(UserResponse):
+    user_role_id: UUID | None = None
+    created_at: datetime
+
+
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    next_cursor: str | None = None
@@ -1,5 +1,12 @@
+import secrets
+import time
+
 from sqlalchemy import UUID
-from src.auth.dals import RoleDAL, UserDAL, PermissionDAL, RedisDAL
+
+from src.auth.cache import role_permission_cache, permission_registry_cache, PermissionRegistry, role_name_cache, \
+    permission_name_cache
+from src.auth.dals import RoleDAL, UserDAL, PermissionDAL, RedisDAL, SessionDAL, RateLimitDAL
+from src.config import settings
 
 
 class UserService:
@@ -21,11 +28,42 @@ class UserService:
             return user
         raise LookupError('User Not Found')
 
+    async def get_user_with_permission_names_by_email(self, email: str):
+        version = role_permission_cache.version
+        from_primary = False
+        row = await self.user_dal.get_user_with_permission_names_by_email(email)
+        if row is None:
+            # реплика могла еще не получить только что зарегистрированного пользователя
+            row = await self.user_dal.get_user_with_permission_names_by_email(email, replica=False)
+            from_primary = True
+        if row:
+            user, names = row
+            # кэш без TTL заполняется только с primary: отстающая реплика вернула бы права,
+            # сброшенные событием инвалидации
+            if names and from_primary:
+                role_permission_cache.set(user.user_role_id, names, version)
+            return user, frozenset(names)
+        raise LookupError('User Not Found')
+
+    async def list_users(self, limit: int, after=None, role_name: str | None = None, is_active: bool | None = None):
+        return await self.user_dal.list_users(limit, after, role_name, is_active)
+
+    def stream_users(self, active_only: bool = False, role_name: str | None = None):
+        return self.user_dal.stream_users(active_only, role_name, settings.EXPORT_BATCH_SIZE)
+
+    async def import_users(self, records) -> set[str]:
+        if not records:
+            return set()
+        return await self.user_dal.copy_users(records)
+
     async def update_user(self, user_id: UUID, **kwargs):
         if user := await self.user_dal.update_user(user_id, **kwargs):
             return user
         raise RuntimeError('User Not Updated')
 
+    async def update_password_hash(self, user_id: UUID, old_hash: str, new_hash: str) -> bool:
+        return await self.user_dal.update_password_hash(user_id, old_hash, new_hash)
+
     async def soft_delete(self, user_id: UUID):
         if user := await self.user_dal.soft_delete_user(user_id):
             return user
@@ -37,10 +75,26 @@ class RoleService:
         self.role_dal = role_dal
 
     async def get_role_id(self, role_name: str):
+        if role_id := role_name_cache.get(role_name):
+            return role_id
+        version = role_name_cache.version
         if role_id := await self.role_dal.get_role_id_by_name(role_name):
+            role_name_cache.set(role_name, role_id, version)
             return role_id
         raise LookupError('Role Not Found')
 
+    async def list_roles(self, limit: int, after: str | None = None):
+        return await self.role_dal.list_roles(limit, after)
+
+    async def get_role_ids(self, role_names) -> dict:
+        role_ids, missing = role_name_cache.get_many(role_names)
+        if missing:
+            version = role_name_cache.version
+            for name, role_id in (await self.role_dal.get_role_ids_by_names(missing)).items():
+                role_name_cache.set(name, role_id, version)
+                role_ids[name] = role_id
+        return role_ids
+
     async def get_role_by_name(self, role_name: str):
         if role := await self.role_dal.get_role_by_name(role_name):
             return role
@@ -86,13 +140,48 @@ class PermissionService:
             return permission
         raise RuntimeError('Permission Not Deleted')
 
+    async def get_role_and_permission_ids(self, role_names, permission_names):
+        role_ids, missing_roles = role_name_cache.get_many(set(role_names))
+        permission_ids, missing_permissions = permission_name_cache.get_many(set(permission_names))
+        if missing_roles or missing_permissions:
+            role_version, permission_version = role_name_cache.version, permission_name_cache.version
+            found_roles, found_permissions = await self.permission_dal.get_role_and_permission_ids(
+                missing_roles, missing_permissions)
+            for name, role_id in found_roles.items():
+                role_name_cache.set(name, role_id, role_version)
+            for name, permission_id in found_permissions.items():
+                permission_name_cache.set(name, permission_id, permission_version)
+            role_ids.update(found_roles)
+            permission_ids.update(found_permissions)
+        missing = sorted(
+            {f'role {name}' for name in role_names if name not in role_ids}
+            | {f'permission {name}' for name in permission_names if name not in permission_ids}
+        )
+        if missing:
+            raise LookupError(f'Not Found: {", ".join(missing)}')
+        return role_ids, permission_ids
+
+    async def add_permissions_to_roles(self, pairs) -> set[tuple]:
+        if not pairs:
+            return set()
+        return await self.permission_dal.add_permissions_to_roles(pairs)
+
+    async def remove_permissions_from_roles(self, pairs) -> set[tuple]:
+        if not pairs:
+            return set()
+        return await self.permission_dal.remove_permissions_from_roles(pairs)
+
     async def add_permission_to_role(self, role_id, permission_id):
         if permission := await self.permission_dal.add_permission_to_role(role_id, permission_id):
             return permission
         raise RuntimeError('Permission Not Added')
 
     async def get_permission_id_by_name(self, name):
+        if permission_id := permission_name_cache.get(name):
+            return permission_id
+        version = permission_name_cache.version
         if permission_id := await self.permission_dal.get_permission_id_by_name(name):
+            permission_name_cache.set(name, permission_id, version)
             return permission_id
         raise LookupError('Permission Not Found')
 
@@ -101,6 +190,38 @@ class PermissionService:
             return permissions
         raise LookupError('Permission Not Found')
 
+    async def get_permission_names_by_role(self, role_id):
+        if (names := role_permission_cache.get(role_id)) is not None:
+            return names
+        version = role_permission_cache.version
+        permissions = await self.get_permissions_by_role(role_id)
+        names = frozenset(permission.name for permission in permissions)
+        role_permission_cache.set(role_id, names, version)
+        return names
+
+    async def warm_up_permission_cache(self):
+        version = role_permission_cache.version
+        roles = {}
+        for role_id, name in await self.permission_dal.get_all_role_permission_names():
+            roles.setdefault(role_id, set()).add(name)
+        for role_id, names in roles.items():
+            role_permission_cache.set(role_id, names, version)
+
+    async def list_permissions(self, limit: int, after: str | None = None):
+        return await self.permission_dal.list_permissions(limit, after)
+
+    async def load_permission_registry(self):
+        permissions = await self.permission_dal.get_all_permissions()
+        registry = PermissionRegistry(permission.name for permission in permissions)
+        permission_registry_cache.set(registry)
+        return registry
+
+    async def get_permission_registry(self, names=()):
+        registry = permission_registry_cache.current
+        if registry is None or not registry.covers(names):
+            registry = await self.load_permission_registry()
+        return registry
+
     async def delete_permission(self, permission_id):
         if permissions := await self.permission_dal.delete_permission(permission_id):
             return permissions
@@ -131,4 +252,62 @@ class RedisService:
             return key
 
     async def key_exists(self, key: str) -> bool:
-        return await self.redis_dal.key_exists(key)
\ No newline at end of file
+        return await self.redis_dal.key_exists(key)
+
+    async def publish(self, channel: str, message: str):
+        await self.redis_dal.publish(channel, message)
+
+    async def set_key_and_publish(self, key: str, value: str, expire_seconds: int, channel: str, message: str):
+        await self.redis_dal.set_key_and_publish(str(key), value, expire_seconds, channel, message)
+
+    async def get_keys_with_ttl(self, pattern: str):
+        return await self.redis_dal.get_keys_with_ttl(pattern)
+
+
+class SessionService:
+    def __init__(self, session_dal: SessionDAL):
+        self.session_dal = session_dal
+
+    @staticmethod
+    def _ttl() -> int:
+        return settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
+
+    @staticmethod
+    def _new_token(user_id: str) -> str:
+        # id пользователя в токене: по нему строятся ключи сессии без лишнего чтения из Redis
+        return f"{user_id}.{secrets.token_urlsafe(32)}"
+
+    async def create_session(self, user_id) -> str:
+        refresh_token = self._new_token(str(user_id))
+        await self.session_dal.add_session(
+            str(user_id), refresh_token, self._ttl(), time.time(), settings.MAX_SESSIONS_PER_USER
+        )
+        return refresh_token
+
+    async def rotate_session(self, refresh_token: str):
+        user_id, _, secret = refresh_token.partition(".")
+        if not user_id or not secret:
+            raise LookupError('Session Not Found')
+        new_refresh_token = self._new_token(user_id)
+        if await self.session_dal.rotate_session(
+                user_id, refresh_token, new_refresh_token, self._ttl(), time.time()):
+            return user_id, new_refresh_token
+        raise LookupError('Session Not Found')
+
+    async def revoke_session(self, user_id, refresh_token: str) -> bool:
+        return await self.session_dal.revoke_session(str(user_id), refresh_token)
+
+    async def revoke_all_sessions(self, user_id) -> int:
+        return await self.session_dal.revoke_all_sessions(str(user_id))
+
+
+class RateLimitService:
+    def __init__(self, rate_limit_dal: RateLimitDAL):
+        self.rate_limit_dal = rate_limit_dal
+
+    async def hit(self, limits: dict, window: int) -> float:
+        # 0, если попытка разрешена, иначе через сколько секунд повторить
+        retry_after_ms = await self.rate_limit_dal.hit(
+            limits, int(time.time() * 1000), window * 1000, secrets.token_hex(8)
+        )
+        return retry_after_ms / 1000
@@ -1,22 +1,23 @@
-import secrets
-
 from fastapi import HTTPException
+from pydantic import ValidationError
 from starlette import status
 
+from src.auth.bulk import batched, encode_records
+from src.auth.pagination import paginate, decode_user_cursor, decode_name_cursor
+from src.auth.events import invalidate_role_permissions, revoke_access_tokens, invalidate_permission_registry, \
+    invalidate_role_name, invalidate_permission_name, store_permission_registry
+from src.auth.profiling import profile_use_cases
 from src.auth.schemas import UserCreate, RoleCreate, RoleResponse, PermissionCreate, PermissionResponse, \
     AddPermissionToRole, Login, UserUpdate, DeletePermissionFromRole, DeletePermission, UpdatePermission, DeleteRole, \
-    UpdateRole
+    UpdateRole, UserImport, ImportReport, ImportRowError, Page, UserListItem, RolePermissionPair, RolePermissionPairs, \
+    RolePermissionPairsResult
 from src.config import settings
 
 
+@profile_use_cases
 class UserUseCases:
-    def __init__(self, user_service, role_service, permission_service, password_hasher, user_mapper, jwt,
-                 payload_mapper, redis_service, session, user_update_mapper):
-        self.user_service = user_service
-        self.permission_service = permission_service
-        self.role_service = role_service
-        self.redis_service = redis_service
-        self.session = session
+    def __init__(self, uow, password_hasher, user_mapper, jwt, payload_mapper, user_update_mapper):
+        self.uow = uow
         self.password_hasher = password_hasher
         self.user_mapper = user_mapper
         self.jwt = jwt
@@ -24,179 +25,346 @@ class UserUseCases:
         self.user_update_mapper = user_update_mapper
 
     async def create_user(self, user_create: UserCreate):
-        async with self.session.begin():
-            role = await self.role_service.get_role_by_name(user_create.user_role)
-
-            hashed_password = self.password_hasher.hash(user_create.password)
+        # совпадение password и password_repeat уже проверено в UserCreate
+        hashed_password = await self.password_hasher.hash(user_create.password)
 
-            self.password_hasher.verify(user_create.password_repeat, hashed_password)
+        async with self.uow.session.begin():
+            role_id = await self.uow.role_service.get_role_id(user_create.user_role)
 
-            user_data = self.user_mapper.to_entity(user_create, role.role_id, hashed_password)
+            user_data = self.user_mapper.to_entity(user_create, role_id, hashed_password)
 
-            user_entity = await self.user_service.create_user(**user_data)
+            user_entity = await self.uow.user_service.create_user(**user_data)
 
             return self.user_mapper.to_response(user_entity)
 
+    async def import_users(self, records, default_role: str | None = None) -> ImportReport:
+        report = ImportReport()
+        role_ids = {}
+        seen_emails = set()
+
+        def reject(line: int, email, error: str):
+            report.failed += 1
+            report.errors.append(ImportRowError(line=line, email=email, error=error))
+
+        async for batch in batched(records, settings.IMPORT_BATCH_SIZE):
+            users = []
+            for line, record in batch:
+                if isinstance(record, str):
+                    reject(line, None, record)
+                    continue
+                try:
+                    user_import = UserImport.model_validate(record)
+                except ValidationError as exc:
+                    # email из невалидной строки может быть не строкой
+                    email = record.get('email')
+                    reject(line, email if isinstance(email, str) else None,
+                           '; '.join(error['msg'] for error in exc.errors()))
+                    continue
+                user_import.user_role = user_import.user_role or default_role
+                if not user_import.user_role:
+                    reject(line, user_import.email, 'Role is required')
+                elif user_import.email in seen_emails:
+                    reject(line, user_import.email, 'Duplicate email in import')
+                else:
+                    seen_emails.add(user_import.email)
+                    users.append((line, user_import))
+
+            if unknown_roles := {user.user_role for _, user in users} - role_ids.keys():
+                async with self.uow.session.begin():
+                    found = await self.uow.role_service.get_role_ids(unknown_roles)
+                role_ids.update({name: found.get(name) for name in unknown_roles})
+
+            valid = []
+            for line, user in users:
+                if role_ids[user.user_role] is None:
+                    reject(line, user.email, 'Role Not Found')
+                else:
+                    valid.append((line, user))
+            if not valid:
+                continue
+
+            hashed_passwords = await self.password_hasher.hash_many(user.password for _, user in valid)
+            user_records = [
+                self.user_mapper.to_record(user, role_ids[user.user_role], hashed_password)
+                for (_, user), hashed_password in zip(valid, hashed_passwords)
+            ]
+
+            async with self.uow.session.begin():
+                created = await self.uow.user_service.import_users(user_records)
+
+            report.created += len(created)
+            for line, user in valid:
+                if user.email not in created:
+                    reject(line, user.email, 'User with this email already exists')
+
+        report.errors.sort(key=lambda error: error.line)
+        return report
+
+    async def list_users(self, limit: int, cursor: str | None = None, role_name: str | None = None,
+                         is_active: bool | None = None) -> Page[UserListItem]:
+        after = decode_user_cursor(cursor) if cursor else None
+        async with self.uow.session.begin():
+            users = await self.uow.user_service.list_users(limit + 1, after, role_name, is_active)
+        users, next_cursor = paginate(users, limit, lambda user: (user.created_at, user.user_id))
+        return Page[UserListItem](items=[UserListItem.model_validate(user) for user in users], next_cursor=next_cursor)
+
     async def update_user(self, payload, user_update: UserUpdate):
-        async with self.session.begin():
+        async with self.uow.session.begin():
             user_data = self.user_update_mapper.to_entity(user_update)
 
-            user_entity = await self.user_service.update_user(payload['user_id'], **user_data)
+            user_entity = await self.uow.user_service.update_user(payload['user_id'], **user_data)
 
             return self.user_mapper.to_response(user_entity)
 
     async def delete_user(self, payload):
-        async with self.session.begin():
-            user_entity = await self.user_service.soft_delete(payload['user_id'])
-            self.redis_service.delete_key(payload['user_id'])
-            return self.user_mapper.to_response(user_entity)
+        async with self.uow.session.begin():
+            user_entity = await self.uow.user_service.soft_delete(payload['user_id'])
+        await self.uow.session_service.revoke_all_sessions(payload['user_id'])
+        await revoke_access_tokens(self.uow.redis_service, payload['user_id'])
+        return self.user_mapper.to_response(user_entity)
+
+
+@profile_use_cases
+class UserExportCases:
+    COLUMNS = ('user_id', 'full_name', 'email', 'is_active', 'created_at', 'role')
 
+    def __init__(self, session_factory, user_service_factory):
+        self.session_factory = session_factory
+        self.user_service_factory = user_service_factory
 
+    async def export_users(self, fmt: str, active_only: bool = False, role_name: str | None = None):
+        # сессия запроса закрывается до начала стриминга, поэтому своя на все время выгрузки
+        async with self.session_factory() as session:
+            async with session.begin():
+                partitions = self.user_service_factory(session).stream_users(active_only, role_name)
+                async for chunk in encode_records(partitions, fmt, self.COLUMNS):
+                    yield chunk
+
+
+@profile_use_cases
 class AuthCases:
-    def __init__(self, user_service, permission_service, password_hasher, user_mapper, jwt,
-                 payload_mapper, redis_service, session):
-        self.user_service = user_service
-        self.permission_service = permission_service
-        self.redis_service = redis_service
-        self.session = session
+    def __init__(self, uow, password_hasher, user_mapper, jwt, payload_mapper, uow_factory=None, tasks=None):
+        self.uow = uow
         self.password_hasher = password_hasher
         self.user_mapper = user_mapper
         self.jwt = jwt
         self.payload_mapper = payload_mapper
+        # для пересчета хеша после ответа: сессия запроса к тому времени закрыта
+        self.uow_factory = uow_factory
+        self.tasks = tasks
+
+    async def _permission_registry(self, permissions):
+        if not settings.COMPACT_PERMISSIONS:
+            return None
+        registry = await self.uow.permission_service.get_permission_registry(permissions)
+        # токен с этой версией может прийти на любой узел
+        await store_permission_registry(self.uow.redis_service, registry)
+        return registry
 
     async def login(self, login: Login):
-        async with self.session.begin():
-            user = await self.user_service.get_user_by_email(login.email)
+        async with self.uow.session.begin():
+            user, permissions = await self.uow.user_service.get_user_with_permission_names_by_email(login.email)
 
-            if not user.is_active:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Account is deactivated"
-                )
+        if not user.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Account is deactivated"
+            )
 
-            self.password_hasher.verify(login.password, user.password_hash)
+        await self.password_hasher.verify(login.password, user.password_hash)
 
-            permissions = await self.permission_service.get_permissions_by_role(user.user_role_id)
-            user_data = self.payload_mapper.to_entity(login.email, user.user_role_id, user.user_id, permissions)
+        if (settings.PASSWORD_REHASH_ON_LOGIN and self.tasks is not None
+                and self.password_hasher.needs_update(user.password_hash)):
+            self.tasks.spawn(self._rehash_password(user.user_id, login.password, user.password_hash))
 
-            access_token = self.jwt.create_access_token(user_data)
+        if not permissions:
+            raise LookupError('Permission Not Found')
 
-            refresh_token = secrets.token_urlsafe(32)
+        async with self.uow.session.begin():
+            registry = await self._permission_registry(permissions)
 
-            await self.redis_service.set_key(
-                f"refresh_token:{refresh_token}",
-                str(user.user_id),
-                settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
-            )
+        user_data = self.payload_mapper.to_entity(login.email, user.user_role_id, user.user_id, permissions,
+                                                  registry)
 
-            await self.redis_service.set_key(
-                f"user_refresh_tokens:{user.user_id}",
-                refresh_token,
-                settings.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
-            )
+        access_token = self.jwt.create_access_token(user_data)
 
-            return access_token, refresh_token
+        refresh_token = await self.uow.session_service.create_session(user.user_id)
 
-    async def refresh_token(self, refresh_token: str):
-        user_id = await self.redis_service.get_key(f"refresh_token:{refresh_token}")
+        return access_token, refresh_token
+
+    async def _rehash_password(self, user_id, password: str, old_hash: str):
+        try:
+            new_hash = await self.password_hasher.hash(password)
+        except HTTPException:
+            # очередь хеширования занята входами, пересчитаем при следующем
+            return
+        uow = self.uow_factory()
+        try:
+            async with uow.session.begin():
+                await uow.user_service.update_password_hash(user_id, old_hash, new_hash)
+        finally:
+            await uow.close()
 
-        if not user_id:
+    async def refresh_token(self, refresh_token: str):
+        try:
+            user_id, new_refresh_token = await self.uow.session_service.rotate_session(refresh_token)
+        except LookupError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid or expired refresh token"
-            )
+            ) from None
 
-        async with self.session.begin():
-            user = await self.user_service.get_user_by_id(user_id)
+        async with self.uow.session.begin():
+            user = await self.uow.user_service.get_user_by_id(user_id)
 
             if not user.is_active:
+                await self.uow.session_service.revoke_all_sessions(user_id)
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="Account is deactivated"
                 )
 
-            permissions = await self.permission_service.get_permissions_by_role(user.user_role_id)
+            permissions = await self.uow.permission_service.get_permission_names_by_role(user.user_role_id)
             user_data = self.payload_mapper.to_entity(
                 user.email,
                 user.user_role_id,
                 user.user_id,
-                permissions
+                permissions,
+                await self._permission_registry(permissions)
             )
 
             access_token = self.jwt.create_access_token(user_data)
 
-            return access_token
+            return access_token, new_refresh_token
+
+    async def logout(self, payload, refresh_token: str | None):
+        if refresh_token:
+            await self.uow.session_service.revoke_session(payload['user_id'], refresh_token)
+        await revoke_access_tokens(self.uow.redis_service, payload['user_id'])
 
-    async def logout(self, payload):
-        async with self.session.begin():
-            await self.redis_service.delete_key(payload['user_id'])
-            refresh_token_key = await self.redis_service.get_key(f"user_refresh_tokens:{payload['user_id']}")
-            await self.redis_service.delete_key(refresh_token_key)
-            await self.redis_service.delete_key(f"user_refresh_tokens:{payload['user_id']}")
+    async def logout_all(self, payload):
+        await self.uow.session_service.revoke_all_sessions(payload['user_id'])
+        await revoke_access_tokens(self.uow.redis_service, payload['user_id'])
 
 
+@profile_use_cases
 class RoleCases:
-    def __init__(self, role_service, session):
-        self.role_service = role_service
-        self.session = session
+    def __init__(self, uow):
+        self.uow = uow
 
     async def create_role(self, role_create: RoleCreate):
-        async with self.session.begin():
-            orm_response = await self.role_service.add_role_by_name(role_create.name)
-            return RoleResponse.model_validate(orm_response)
+        async with self.uow.session.begin():
+            orm_response = await self.uow.role_service.add_role_by_name(role_create.name)
+        await invalidate_role_name(self.uow.redis_service, role_create.name)
+        return RoleResponse.model_validate(orm_response)
+
+    async def list_roles(self, limit: int, cursor: str | None = None) -> Page[RoleResponse]:
+        after = decode_name_cursor(cursor) if cursor else None
+        async with self.uow.session.begin():
+            roles = await self.uow.role_service.list_roles(limit + 1, after)
+        roles, next_cursor = paginate(roles, limit, lambda role: (role.name,))
+        return Page[RoleResponse](items=[RoleResponse.model_validate(role) for role in roles], next_cursor=next_cursor)
 
     async def delete_role(self, delete_role: DeleteRole):
-        async with self.session.begin():
-            role_id = await self.role_service.get_role_id(delete_role.role_name)
-            orm_response = await self.role_service.delete_role(
+        async with self.uow.session.begin():
+            role_id = await self.uow.role_service.get_role_id(delete_role.role_name)
+            orm_response = await self.uow.role_service.delete_role(
                 role_id)
-            return orm_response
+        await invalidate_role_name(self.uow.redis_service, delete_role.role_name)
+        await invalidate_role_permissions(self.uow.redis_service, role_id)
+        return orm_response
 
     async def update_role(self, update_role: UpdateRole):
-        async with self.session.begin():
-            role_id = await self.role_service.get_role_id(update_role.role_name)
-            orm_response = await self.role_service.update_role(
+        async with self.uow.session.begin():
+            role_id = await self.uow.role_service.get_role_id(update_role.role_name)
+            orm_response = await self.uow.role_service.update_role(
                 role_id, update_role.new_name)
-            return orm_response
+        await invalidate_role_name(self.uow.redis_service, update_role.role_name)
+        await invalidate_role_permissions(self.uow.redis_service, role_id)
+        return orm_response
 
 
+@profile_use_cases
 class PermissionCases:
-    def __init__(self, role_service, permission_service, session):
-        self.permission_service = permission_service
-        self.role_service = role_service
-        self.session = session
+    def __init__(self, uow):
+        self.uow = uow
 
     async def create_permission(self, permission_create: PermissionCreate):
-        async with self.session.begin():
-            orm_response = await self.permission_service.create_permission(permission_create.name)
-            return PermissionResponse.model_validate(orm_response)
+        async with self.uow.session.begin():
+            orm_response = await self.uow.permission_service.create_permission(permission_create.name)
+        await invalidate_permission_name(self.uow.redis_service, permission_create.name)
+        await invalidate_permission_registry(self.uow.redis_service)
+        return PermissionResponse.model_validate(orm_response)
+
+    async def list_permissions(self, limit: int, cursor: str | None = None) -> Page[PermissionResponse]:
+        after = decode_name_cursor(cursor) if cursor else None
+        async with self.uow.session.begin():
+            permissions = await self.uow.permission_service.list_permissions(limit + 1, after)
+        permissions, next_cursor = paginate(permissions, limit, lambda permission: (permission.name,))
+        return Page[PermissionResponse](
+            items=[PermissionResponse.model_validate(permission) for permission in permissions],
+            next_cursor=next_cursor
+        )
 
     async def add_permission_to_role(self, add_permission_to_role: AddPermissionToRole):
-        async with self.session.begin():
-            role_id = await self.role_service.get_role_id(add_permission_to_role.role_name)
-            permission_id = await self.permission_service.get_permission_id_by_name(
+        async with self.uow.session.begin():
+            role_id = await self.uow.role_service.get_role_id(add_permission_to_role.role_name)
+            permission_id = await self.uow.permission_service.get_permission_id_by_name(
                 add_permission_to_role.permission_name)
-            orm_response = await self.permission_service.add_permission_to_role(role_id, permission_id)
-            return orm_response
+            orm_response = await self.uow.permission_service.add_permission_to_role(role_id, permission_id)
+        await invalidate_role_permissions(self.uow.redis_service, role_id)
+        return orm_response
+
+    async def add_permissions_to_roles(self, bulk: RolePermissionPairs) -> RolePermissionPairsResult:
+        return await self._change_role_permissions(bulk, self.uow.permission_service.add_permissions_to_roles)
+
+    async def remove_permissions_from_roles(self, bulk: RolePermissionPairs) -> RolePermissionPairsResult:
+        return await self._change_role_permissions(bulk, self.uow.permission_service.remove_permissions_from_roles)
+
+    async def _change_role_permissions(self, bulk: RolePermissionPairs, change) -> RolePermissionPairsResult:
+        names = list(dict.fromkeys((pair.role_name, pair.permission_name) for pair in bulk.pairs))
+        async with self.uow.session.begin():
+            role_ids, permission_ids = await self.uow.permission_service.get_role_and_permission_ids(
+                {role_name for role_name, _ in names}, {permission_name for _, permission_name in names})
+            pairs = {(role_ids[role_name], permission_ids[permission_name]): (role_name, permission_name)
+                     for role_name, permission_name in names}
+            changed = await change(list(pairs))
+
+        if changed_roles := {role_id for role_id, _ in changed}:
+            await invalidate_role_permissions(
+                self.uow.redis_service, next(iter(changed_roles)) if len(changed_roles) == 1 else None)
+
+        result = RolePermissionPairsResult(changed=[], unchanged=[])
+        for ids, (role_name, permission_name) in pairs.items():
+            pair = RolePermissionPair(role_name=role_name, permission_name=permission_name)
+            (result.changed if ids in changed else result.unchanged).append(pair)
+        return result
 
     async def remove_permission_from_role(self, delete_perm_from_role: DeletePermissionFromRole):
-        async with self.session.begin():
-            role_id = await self.role_service.get_role_id(delete_perm_from_role.role_name)
-            permission_id = await self.permission_service.get_permission_id_by_name(
+        async with self.uow.session.begin():
+            role_id = await self.uow.role_service.get_role_id(delete_perm_from_role.role_name)
+            permission_id = await self.uow.permission_service.get_permission_id_by_name(
                 delete_perm_from_role.permission_name)
-            orm_response = await self.permission_service.remove_permission_from_role(role_id, permission_id)
-            return orm_response
+            orm_response = await self.uow.permission_service.remove_permission_from_role(role_id, permission_id)
+        await invalidate_role_permissions(self.uow.redis_service, role_id)
+        return orm_response
 
     async def delete_permission(self, delete_perm: DeletePermission):
-        async with self.session.begin():
-            permission_id = await self.permission_service.get_permission_id_by_name(
+        async with self.uow.session.begin():
+            permission_id = await self.uow.permission_service.get_permission_id_by_name(
                 delete_perm.permission_name)
-            orm_response = await self.permission_service.delete_permission(permission_id)
-            return orm_response
+            orm_response = await self.uow.permission_service.delete_permission(permission_id)
+        await invalidate_permission_name(self.uow.redis_service, delete_perm.permission_name)
+        await invalidate_role_permissions(self.uow.redis_service)
+        await invalidate_permission_registry(self.uow.redis_service)
+        return orm_response
 
     async def update_permission(self, update_perm: UpdatePermission):
-        async with self.session.begin():
-            permission_id = await self.permission_service.get_permission_id_by_name(
+        async with self.uow.session.begin():
+            permission_id = await self.uow.permission_service.get_permission_id_by_name(
                 update_perm.permission_name)
-            orm_response = await self.permission_service.update_permission(permission_id, update_perm.new_name)
-            return orm_response
+            orm_response = await self.uow.permission_service.update_permission(permission_id, update_perm.new_name)
+        await invalidate_permission_name(self.uow.redis_service, update_perm.permission_name)
+        await invalidate_role_permissions(self.uow.redis_service)
+        await invalidate_permission_registry(self.uow.redis_service)
+        return orm_response
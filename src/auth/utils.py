@@ -1,26 +1,260 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import timedelta, datetime
+from pathlib import Path
 from uuid import UUID
 
-from jose import jwt
+from fastapi import HTTPException
+from jose import jwk, jwt, JWTError
 from passlib.context import CryptContext
+from starlette import status
 
+from src.auth.metrics import Histogram, LabeledHistogram, registry
 from src.config import settings
 
+logger = logging.getLogger(__name__)
+
+
+def _read_cgroup(path: str) -> list[str] | None:
+    try:
+        with open(path) as file:
+            return file.read().split()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit() -> float | None:
+    # cgroup v2: "<quota> <period>" или "max <period>"
+    if (values := _read_cgroup("/sys/fs/cgroup/cpu.max")) is not None:
+        return int(values[0]) / int(values[1]) if values[0] != "max" else None
+    # cgroup v1: quota -1 означает без ограничения
+    quota = _read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota[0]) > 0:
+        return int(quota[0]) / int(period[0])
+    return None
+
+
+def available_cpus() -> int:
+    # os.cpu_count() видит все ядра хоста, а не affinity и квоту контейнера
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    if (limit := cgroup_cpu_limit()) is not None:
+        cpus = min(cpus, math.ceil(limit))
+    return max(1, cpus)
+
+
+def create_password_context(schemes, bcrypt_rounds: int) -> CryptContext:
+    options = {"bcrypt__rounds": bcrypt_rounds} if "bcrypt" in schemes else {}
+    # хеши устаревших схем и bcrypt с другим числом раундов needs_update отмечает как требующие пересчета
+    return CryptContext(schemes=list(schemes), deprecated="auto", **options)
+
+
+pwd_context = create_password_context(settings.PASSWORD_SCHEMES, settings.BCRYPT_ROUNDS)
+
+
+def _hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def _timed_call(fn, *args):
+    return time.perf_counter(), fn(*args)
+
+
+class HashingPool:
+    def __init__(self, max_workers: int, max_queue: int, use_processes: bool = False):
+        self.max_workers = max_workers or available_cpus()
+        self.max_queue = max_queue
+        self.use_processes = use_processes
+        self.pending = 0
+        self.rejected = 0
+        self.wait_time = Histogram('hash_queue_wait_seconds', 'Time a hashing job waits for a free worker')
+        self.run_time = Histogram('hash_run_seconds', 'Time a hashing job runs in a worker')
+        self.operation_time = LabeledHistogram(
+            'hash_operation_seconds', 'Time a hashing job runs in a worker by operation', ('operation',)
+        )
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hashing')
+        return self._executor
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self.pending - self.max_workers, 0)
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Password hashing queue is full",
+                headers={"Retry-After": "1"}
+            )
+        return await self._submit(fn, *args)
+
+    async def map(self, fn, items):
+        # массовые операции не упираются в лимит очереди, но держат в executor не больше max_workers задач,
+        # чтобы одиночные запросы не вставали за всей пачкой
+        results = []
+        for start in range(0, len(items), self.max_workers):
+            chunk = items[start:start + self.max_workers]
+            results.extend(await asyncio.gather(*(self._submit(fn, item) for item in chunk)))
+        return results
+
+    async def _submit(self, fn, *args):
+        self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            started, result = await loop.run_in_executor(self.executor, _timed_call, fn, *args)
+        finally:
+            self.pending -= 1
+        finished = time.perf_counter()
+        self.wait_time.observe(started - submitted)
+        self.run_time.observe(finished - started)
+        self.operation_time.labels(fn.__name__.lstrip('_')).observe(finished - started)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'in_flight': self.pending,
+            'queue_depth': self.queue_depth,
+            'rejected': self.rejected,
+            'wait_time': self.wait_time.snapshot(),
+            'run_time': self.run_time.snapshot(),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+hashing_pool = HashingPool(
+    max_workers=settings.HASH_WORKERS,
+    max_queue=settings.HASH_QUEUE_SIZE,
+    use_processes=settings.HASH_USE_PROCESSES,
+)
+registry.register(hashing_pool.wait_time)
+registry.register(hashing_pool.run_time)
+registry.register(hashing_pool.operation_time)
+
 
 class PasswordHasher:
-    def __init__(self):
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    def __init__(self, pool: HashingPool = hashing_pool):
+        self.pool = pool
 
-    def hash(self, password: str) -> str:
-        return self.pwd_context.hash(password)
+    async def hash(self, password: str) -> str:
+        return await self.pool.run(_hash_password, password)
 
-    def verify(self, plain_password: str, hashed_password: str) -> bool:
-        if self.pwd_context.verify(plain_password, hashed_password):
+    async def hash_many(self, passwords) -> list[str]:
+        return await self.pool.map(_hash_password, list(passwords))
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        if await self.pool.run(_verify_password, plain_password, hashed_password):
             return True
         raise ValueError("passwords not equal")
 
+    @staticmethod
+    def needs_update(hashed_password: str) -> bool:
+        # только разбор строки хеша, без bcrypt
+        return pwd_context.needs_update(hashed_password)
+
+
+class TaskSet:
+    # держит ссылки на фоновые задачи, иначе их может собрать GC до завершения
+    def __init__(self):
+        self._tasks = set()
+        self.failed = 0
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+            logger.warning("background task failed", exc_info=task.exception())
+
+    async def drain(self, timeout: float = 10.0):
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in set(self._tasks):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {'running': len(self._tasks), 'failed': self.failed}
+
+
+background_tasks = TaskSet()
+
+
+class SigningKeys:
+    def __init__(self, keys_dir: str | None, active_kid: str | None, algorithm: str):
+        self.algorithm = algorithm
+        self._private_keys = {}
+        self._public_keys = {}
+        if keys_dir:
+            for path in sorted(Path(keys_dir).glob("*.pem")):
+                private_key = jwk.construct(path.read_text(), algorithm)
+                self._private_keys[path.stem] = private_key
+                self._public_keys[path.stem] = private_key.public_key()
+        if self._private_keys:
+            self.active_kid = active_kid or next(reversed(self._private_keys))
+            if self.active_kid not in self._private_keys:
+                raise RuntimeError(f"Signing key '{self.active_kid}' not found in {keys_dir}")
+        else:
+            self.active_kid = None
+
+    @property
+    def asymmetric(self) -> bool:
+        return self.active_kid is not None
+
+    def signing_key(self):
+        return self._private_keys[self.active_kid]
+
+    def verification_key(self, kid: str | None):
+        if key := self._public_keys.get(kid):
+            return key
+        raise JWTError("Unknown signing key")
+
+    def jwks(self) -> dict:
+        return {
+            "keys": [
+                {**key.to_dict(), "kid": kid, "use": "sig", "alg": self.algorithm}
+                for kid, key in self._public_keys.items()
+            ]
+        }
+
+
+signing_keys = SigningKeys(settings.JWT_KEYS_DIR, settings.JWT_ACTIVE_KID, settings.ALGORITHM)
+
 
 class JWT:
+    def __init__(self, keys: SigningKeys = signing_keys):
+        self.keys = keys
+
     def create_access_token(self, data: dict, expires_delta: timedelta | None = None):
         to_encode = data.copy()
         for key, value in to_encode.items():
@@ -28,11 +262,22 @@ class JWT:
                 to_encode[key] = str(value)
         if expires_delta:
             expire_minutes = int(expires_delta)
-            expire = datetime.utcnow() + timedelta(minutes=expire_minutes)
         else:
-            expire = datetime.utcnow() + timedelta(minutes=15)
-        to_encode.update({"exp": expire})
+            expire_minutes = settings.ACCESS_TOKEN_EXPIRE_MINUTES
+        expire = datetime.utcnow() + timedelta(minutes=expire_minutes)
+        to_encode.update({"exp": expire, "iat": time.time()})
+        if self.keys.asymmetric:
+            return jwt.encode(
+                to_encode, self.keys.signing_key(), algorithm=self.keys.algorithm,
+                headers={"kid": self.keys.active_kid}
+            )
         encoded_jwt = jwt.encode(
             to_encode, str(settings.SECRET_KEY), algorithm=settings.ALGORITHM
         )
         return encoded_jwt
+
+    def decode_access_token(self, token: str) -> dict:
+        if self.keys.asymmetric:
+            key = self.keys.verification_key(jwt.get_unverified_header(token).get("kid"))
+            return jwt.decode(token, key, algorithms=[self.keys.algorithm])
+        return jwt.decode(token, str(settings.SECRET_KEY), algorithms=[settings.ALGORITHM])
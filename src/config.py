@@ -7,18 +7,77 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     DEBUG: bool = False
 
+    WEB_HOST: str = "0.0.0.0"
+    WEB_PORT: int = 8000
+    WEB_WORKERS: int = 0
+    WEB_BACKLOG: int = 2048
+    WEB_KEEP_ALIVE: int = 5
+    WEB_GRACEFUL_TIMEOUT: int = 30
+    WEB_LIMIT_CONCURRENCY: int | None = None
+    WEB_ACCESS_LOG: bool = True
+
     DB_NAME: str
     DB_USER: str
     POSTGRES_PASSWORD: SecretStr
     DB_HOST: str
     DB_PORT: int
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # postgresql+asyncpg://... реплик, JSON-список в переменной окружения
+    DB_REPLICA_URLS: list[str] = []
+    DB_REPLICA_HEALTH_INTERVAL: float = 5.0
+    SQL_PROFILING: bool = False
+    SQL_N_PLUS_ONE_THRESHOLD: int = 5
+    SQL_SLOW_QUERY_MS: float = 100.0
+    SQL_SLOW_QUERY_SAMPLE_RATE: float = 1.0
 
     REDIS_HOST: str
+    REDIS_PORT: int = 6379
+    REDIS_DB: int = 0
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 5.0
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 5.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
 
     SECRET_KEY: SecretStr
     ALGORITHM: str
+    JWT_KEYS_DIR: str | None = None
+    JWT_ACTIVE_KID: str | None = None
+    JWKS_MAX_AGE: int = 300
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     REFRESH_TOKEN_EXPIRE_DAYS: int
+    MAX_SESSIONS_PER_USER: int = 10
+    # False - для тестов на http
+    COOKIE_SECURE: bool = False
+
+    HASH_WORKERS: int = 0
+    HASH_QUEUE_SIZE: int = 64
+    HASH_USE_PROCESSES: bool = False
+    # первая схема - для новых хешей, остальные только проверяются и пересчитываются при входе
+    PASSWORD_SCHEMES: list[str] = ["bcrypt"]
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_REHASH_ON_LOGIN: bool = True
+
+    TOKEN_CACHE_SIZE: int = 10000
+    PERMISSION_CACHE_WARMUP: bool = False
+    COMPACT_PERMISSIONS: bool = False
+    IMPORT_BATCH_SIZE: int = 1000
+    EXPORT_BATCH_SIZE: int = 1000
+    NAME_CACHE_TTL: int = 300
+
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_WINDOW: int = 60
+    RATE_LIMIT_LOCAL_KEYS: int = 10000
+    LOGIN_RATE_LIMIT_PER_IP: int = 30
+    LOGIN_RATE_LIMIT_PER_EMAIL: int = 5
+    REGISTRATION_RATE_LIMIT_PER_IP: int = 10
+    REGISTRATION_RATE_LIMIT_PER_EMAIL: int = 3
 
     model_config = SettingsConfigDict(
         env_file=Path(__file__).parent.parent / ".env",
@@ -1,23 +1,159 @@
 import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Literal
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Query
 from fastapi.params import Depends
 
+from src.auth.bulk import detect_format, iter_lines, iter_records, MEDIA_TYPES
+from src.auth.cache import token_cache, role_permission_cache, revocation_list, role_name_cache, permission_name_cache
+from src.auth.permissions import permission_matchers
+from src.auth.rate_limit import local_rate_limiter
+from src.auth.dals import PermissionDAL
+from src.auth.db import init_redis, close_redis, redis_pool_stats, db_pool_stats, dispose_engine, async_session, \
+    replicas
 from src.auth.dependencies import get_user_use_case, check_permission, get_role_use_case, get_permission_use_case, \
-    get_auth_use_case, get_refresh_token
-from src.auth.middleware import JWTMiddleware, ExceptionMiddleware
-from fastapi import Response
+    get_auth_use_case, get_refresh_token, get_optional_refresh_token, get_user_export_use_case, rate_limit
+from src.auth.events import invalidation_listener
+from src.auth.metrics import registry
+from src.auth.middleware import AuthMiddleware, MetricsMiddleware
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 
 from src.auth.schemas import UserCreate, RoleCreate, PermissionCreate, AddPermissionToRole, Login, DeleteRole, \
-    UpdateRole, DeletePermission, UpdatePermission, UserUpdate
-from src.auth.use_cases import UserUseCases, RoleCases, PermissionCases, AuthCases
-
-app = FastAPI()
-app.add_middleware(JWTMiddleware)
-app.add_middleware(ExceptionMiddleware)
+    UpdateRole, DeletePermission, UpdatePermission, UserUpdate, RolePermissionPairs
+from src.auth.service import PermissionService
+from src.auth.use_cases import UserUseCases, RoleCases, PermissionCases, AuthCases, UserExportCases
+from src.auth.utils import hashing_pool, signing_keys, background_tasks
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_up_permission_cache():
+    try:
+        async with async_session() as session:
+            await PermissionService(PermissionDAL(session)).warm_up_permission_cache()
+    except Exception:
+        logger.warning("permission cache warm-up failed, falling back to lazy loading", exc_info=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    invalidation_listener.start(init_redis())
+    replicas.start()
+    if settings.PERMISSION_CACHE_WARMUP:
+        await warm_up_permission_cache()
+    yield
+    await background_tasks.drain()
+    await invalidation_listener.stop()
+    await replicas.stop()
+    await close_redis()
+    await dispose_engine()
+    hashing_pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(AuthMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+CACHES = {
+    "token_cache": token_cache,
+    "role_permission_cache": role_permission_cache,
+    "permission_matchers": permission_matchers,
+    "role_name_cache": role_name_cache,
+    "permission_name_cache": permission_name_cache,
+}
+
+
+def set_token_cookies(response: Response, access_token: str, refresh_token: str):
+    # одинаковые атрибуты для входа и обновления: иначе браузер отбросит уже ротированный refresh
+    for key, value in (("access_token", access_token), ("refresh_token", refresh_token)):
+        response.set_cookie(
+            key=key,
+            value=value,
+            httponly=True,
+            secure=settings.COOKIE_SECURE,
+            samesite="lax",
+            max_age=24 * 60 * 60,
+            path="/"
+        )
+
+
+def clear_token_cookies(response: Response, *keys: str):
+    for key in keys:
+        response.set_cookie(
+            key=key,
+            value="",
+            httponly=True,
+            secure=settings.COOKIE_SECURE,
+            samesite="lax",
+            max_age=0,
+            expires=0,
+            path="/"
+        )
+
+
+@registry.collector
+def collect_runtime_metrics():
+    cache_stats = {name: cache.stats() for name, cache in CACHES.items()}
+    pool = hashing_pool.stats()
+    return [
+        ("cache_hits_total", "counter", "Cache hits", [
+            ({"cache": name}, stats["hits"]) for name, stats in cache_stats.items()
+        ]),
+        ("cache_misses_total", "counter", "Cache misses", [
+            ({"cache": name}, stats["misses"]) for name, stats in cache_stats.items()
+        ]),
+        ("cache_entries", "gauge", "Entries held in cache", [
+            ({"cache": name}, stats.get("size", stats.get("roles"))) for name, stats in cache_stats.items()
+        ]),
+        ("hash_jobs_in_flight", "gauge", "Hashing jobs running or queued", [({}, pool["in_flight"])]),
+        ("hash_queue_depth", "gauge", "Hashing jobs waiting for a worker", [({}, pool["queue_depth"])]),
+        ("hash_rejected_total", "counter", "Hashing jobs rejected because the queue was full", [
+            ({}, pool["rejected"])
+        ]),
+        ("rate_limit_local_rejected_total", "counter", "Attempts rejected by the local token bucket", [
+            ({}, local_rate_limiter.rejected)
+        ]),
+    ]
+
+
+@app.get("/health")
+async def health():
+    return {
+        "db_pool": db_pool_stats(),
+        "db_replicas": replicas.stats(),
+        "redis_pool": redis_pool_stats(),
+        "hashing_pool": hashing_pool.stats(),
+        "token_cache": token_cache.stats(),
+        "role_permission_cache": role_permission_cache.stats(),
+        "revocation_list": revocation_list.stats(),
+        "permission_matchers": permission_matchers.stats(),
+        "role_name_cache": role_name_cache.stats(),
+        "permission_name_cache": permission_name_cache.stats(),
+        "rate_limiter": local_rate_limiter.stats(),
+        "background_tasks": background_tasks.stats(),
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/.well-known/jwks.json")
+async def jwks():
+    return JSONResponse(
+        content=signing_keys.jwks(),
+        headers={"Cache-Control": f"public, max-age={settings.JWKS_MAX_AGE}"}
+    )
 
 
-@app.post("/registration")
+@app.post("/registration", dependencies=[Depends(rate_limit(
+    "registration", settings.REGISTRATION_RATE_LIMIT_PER_IP, settings.REGISTRATION_RATE_LIMIT_PER_EMAIL
+))])
 async def create_user(
         user_create: UserCreate,
         user_use_cases: UserUseCases = Depends(get_user_use_case)
@@ -44,19 +180,69 @@ async def delete_user(
         content=json.dumps({"message": "delete successful"}),
         media_type="application/json"
     )
-    response.set_cookie(
-        key="access_token",
-        value="",
-        httponly=True,
-        secure=False,
-        samesite="lax",
-        max_age=0,
-        expires=0,
-        path="/"
-    )
+    clear_token_cookies(response, "access_token")
     return response
 
 
+@app.post("/import_users")
+async def import_users(
+        request: Request,
+        format: Literal['csv', 'ndjson'] | None = None,
+        default_role: str | None = None,
+        payload: dict = Depends(check_permission('user:import')),
+        user_use_cases: UserUseCases = Depends(get_user_use_case)
+):
+    records = iter_records(iter_lines(request.stream()), format or detect_format(request.headers.get('content-type')))
+    return await user_use_cases.import_users(records, default_role)
+
+
+@app.get("/export_users")
+async def export_users(
+        format: Literal['csv', 'ndjson'] = 'ndjson',
+        active_only: bool = False,
+        role: str | None = None,
+        payload: dict = Depends(check_permission('user:export')),
+        user_export_cases: UserExportCases = Depends(get_user_export_use_case)
+):
+    return StreamingResponse(
+        user_export_cases.export_users(format, active_only, role),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="users.{format}"'}
+    )
+
+
+@app.get("/users")
+async def list_users(
+        limit: int = Query(50, ge=1, le=500),
+        cursor: str | None = None,
+        role: str | None = None,
+        is_active: bool | None = None,
+        payload: dict = Depends(check_permission('user:list')),
+        user_use_cases: UserUseCases = Depends(get_user_use_case)
+):
+    return await user_use_cases.list_users(limit, cursor, role, is_active)
+
+
+@app.get("/roles")
+async def list_roles(
+        limit: int = Query(50, ge=1, le=500),
+        cursor: str | None = None,
+        payload: dict = Depends(check_permission('role:list')),
+        role_use_cases: RoleCases = Depends(get_role_use_case)
+):
+    return await role_use_cases.list_roles(limit, cursor)
+
+
+@app.get("/permissions")
+async def list_permissions(
+        limit: int = Query(50, ge=1, le=500),
+        cursor: str | None = None,
+        payload: dict = Depends(check_permission('permission:list')),
+        permission_use_cases: PermissionCases = Depends(get_permission_use_case)
+):
+    return await permission_use_cases.list_permissions(limit, cursor)
+
+
 @app.post("/create_role")
 async def create_role(
         create_role: RoleCreate,
@@ -121,30 +307,42 @@ async def add_permission_to_role(
     return await permission_use_cases.add_permission_to_role(add_perm_to_role)
 
 
+@app.post("/add_permissions_to_roles")
+async def add_permissions_to_roles(
+        bulk: RolePermissionPairs,
+        payload: dict = Depends(check_permission('role_permission:update')),
+        permission_use_cases: PermissionCases = Depends(get_permission_use_case)
+):
+    return await permission_use_cases.add_permissions_to_roles(bulk)
+
+
+@app.delete("/remove_permissions_from_roles")
+async def remove_permissions_from_roles(
+        bulk: RolePermissionPairs,
+        payload: dict = Depends(check_permission('role_permission:update')),
+        permission_use_cases: PermissionCases = Depends(get_permission_use_case)
+):
+    return await permission_use_cases.remove_permissions_from_roles(bulk)
+
+
 @app.post("/login_from_refresh_token")
 async def login_from_refresh_token(
         refresh_token: str = Depends(get_refresh_token),
         auth_use_cases: AuthCases = Depends(get_auth_use_case)
 ):
-    token = await auth_use_cases.refresh_token(refresh_token)
+    tokens = await auth_use_cases.refresh_token(refresh_token)
     response = Response(
         content=json.dumps({"message": "Login successful"}),
         media_type="application/json"
     )
-    response.set_cookie(
-        key="access_token",
-        value=token,
-        httponly=True,
-        secure=True,
-        samesite="lax",
-        max_age=24 * 60 * 60,
-        path="/"
-    )
+    set_token_cookies(response, *tokens)
 
     return response
 
 
-@app.post("/login")
+@app.post("/login", dependencies=[Depends(rate_limit(
+    "login", settings.LOGIN_RATE_LIMIT_PER_IP, settings.LOGIN_RATE_LIMIT_PER_EMAIL
+))])
 async def login(
         log: Login,
         auth_use_cases: AuthCases = Depends(get_auth_use_case)
@@ -154,24 +352,7 @@ async def login(
         content=json.dumps({"message": "Login successful"}),
         media_type="application/json"
     )
-    response.set_cookie(
-        key="access_token",
-        value=tokens[0],
-        httponly=True,
-        secure=False,
-        samesite="lax",
-        max_age=24 * 60 * 60,
-        path="/"
-    )
-    response.set_cookie(
-        key="refresh_token",
-        value=tokens[1],
-        httponly=True,
-        secure=False,
-        samesite="lax",
-        max_age=24 * 60 * 60,
-        path="/"
-    )
+    set_token_cookies(response, *tokens)
 
     return response
 
@@ -179,31 +360,27 @@ async def login(
 @app.post("/logout")
 async def logout(
         payload: dict = Depends(check_permission('user:logout')),
+        refresh_token: str | None = Depends(get_optional_refresh_token),
         auth_use_cases: AuthCases = Depends(get_auth_use_case)
 ):
-    await auth_use_cases.logout(payload)
+    await auth_use_cases.logout(payload, refresh_token)
     response = Response(
         content=json.dumps({"message": "Logout successful"}),
         media_type="application/json"
     )
-    response.set_cookie(
-        key="access_token",
-        value="",
-        httponly=True,
-        secure=False,  # для тестов на http
-        samesite="lax",
-        max_age=0,
-        expires=0,
-        path="/"
-    )
-    response.set_cookie(
-        key="refresh_token",
-        value="",
-        httponly=True,
-        secure=False,  # для тестов на http
-        samesite="lax",
-        max_age=0,
-        expires=0,
-        path="/"
+    clear_token_cookies(response, "access_token", "refresh_token")
+    return response
+
+
+@app.post("/logout_all")
+async def logout_all(
+        payload: dict = Depends(check_permission('user:logout')),
+        auth_use_cases: AuthCases = Depends(get_auth_use_case)
+):
+    await auth_use_cases.logout_all(payload)
+    response = Response(
+        content=json.dumps({"message": "Logout successful"}),
+        media_type="application/json"
     )
+    clear_token_cookies(response, "access_token", "refresh_token")
     return response
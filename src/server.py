@@ -0,0 +1,141 @@
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+
+import uvicorn
+
+from src.auth.utils import available_cpus
+from src.config import settings
+
+# логгер uvicorn уже настроен его конфигом логирования
+logger = logging.getLogger("uvicorn.error")
+
+# воркер, упавший быстрее, считается не поднявшимся: перезапуск не поможет
+MIN_WORKER_LIFETIME = 5.0
+
+
+def worker_count(requested: int) -> int:
+    return requested or available_cpus()
+
+
+def build_config(host: str, port: int) -> uvicorn.Config:
+    # приложение импортируется в мастере до fork: воркеры делят уже загруженный код, а не импортируют его заново
+    from src.main import app
+
+    return uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        lifespan="on",
+        backlog=settings.WEB_BACKLOG,
+        timeout_keep_alive=settings.WEB_KEEP_ALIVE,
+        timeout_graceful_shutdown=settings.WEB_GRACEFUL_TIMEOUT,
+        limit_concurrency=settings.WEB_LIMIT_CONCURRENCY,
+        access_log=settings.WEB_ACCESS_LOG,
+    )
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.workers = workers
+        self.socket = None
+        self.children = {}
+        self.stopping = False
+        self.deadline = None
+        self.exit_code = 0
+
+    def run(self) -> int:
+        self.socket = self.config.bind_socket()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._stop)
+        for index in range(self.workers):
+            self._spawn(index)
+        self._wait()
+        return self.exit_code
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker()
+        self.children[pid] = (index, time.monotonic())
+        logger.info("worker %d started with pid %d", index, pid)
+
+    def _run_worker(self):
+        # uvicorn ставит свои обработчики сигналов и сам завершает запросы при SIGTERM
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        from src.auth.utils import hashing_pool
+        if not settings.HASH_WORKERS:
+            # потоки bcrypt делят ядра между всеми воркерами
+            hashing_pool.max_workers = max(1, available_cpus() // self.workers)
+        code = 0
+        try:
+            uvicorn.Server(self.config).run(sockets=[self.socket])
+        except BaseException:
+            logger.exception("worker crashed")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        self.deadline = time.monotonic() + (settings.WEB_GRACEFUL_TIMEOUT or 0) + 5
+        logger.info("received %s, stopping %d workers", signal.Signals(signum).name, len(self.children))
+        self._signal_children(signal.SIGTERM)
+
+    def _signal_children(self, signum: int):
+        for pid in self.children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _wait(self):
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.stopping and time.monotonic() > self.deadline:
+                    logger.warning("workers did not stop in time, killing")
+                    self._signal_children(signal.SIGKILL)
+                    self.deadline = float("inf")
+                time.sleep(0.2)
+                continue
+            index, started = self.children.pop(pid)
+            if self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            logger.warning("worker %d (pid %d) exited with %d", index, pid, code)
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                logger.error("worker %d failed on startup, shutting down", index)
+                self.exit_code = 1
+                self._stop(signal.SIGTERM, None)
+                continue
+            self._spawn(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Production server: preloaded app, forked uvicorn workers")
+    parser.add_argument("--host", default=settings.WEB_HOST)
+    parser.add_argument("--port", type=int, default=settings.WEB_PORT)
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS, help="0 - one per available CPU (affinity and cgroup quota)")
+    args = parser.parse_args()
+
+    config = build_config(args.host, args.port)
+    workers = worker_count(args.workers)
+    if workers == 1:
+        uvicorn.Server(config).run()
+        return 0
+    logger.info("starting %d workers on %s:%d", workers, args.host, args.port)
+    return Supervisor(config, workers).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from uuid import uuid4
+
+for name, value in {
+    'DB_NAME': 'auth_db', 'DB_USER': 'postgres', 'POSTGRES_PASSWORD': 'postgres', 'DB_HOST': 'localhost',
+    'DB_PORT': '5432', 'REDIS_HOST': 'localhost', 'SECRET_KEY': 'secret', 'ALGORITHM': 'HS256',
+    'ACCESS_TOKEN_EXPIRE_MINUTES': '15', 'REFRESH_TOKEN_EXPIRE_DAYS': '7',
+}.items():
+    os.environ.setdefault(name, value)
+
+from src.auth.bulk import CSV, NDJSON, iter_lines, iter_records  # noqa: E402
+from src.auth.mappers import UserMapper  # noqa: E402
+from src.auth.use_cases import UserUseCases  # noqa: E402
+
+
+class FakeSession:
+    @asynccontextmanager
+    async def begin(self):
+        yield
+
+
+class FakeRoleService:
+    async def get_role_ids(self, names):
+        return {name: uuid4() for name in names if name == 'user'}
+
+
+class FakeUserService:
+    def __init__(self):
+        self.imported = []
+
+    async def import_users(self, records):
+        self.imported.extend(records)
+        return {record[2] for record in records}
+
+
+class FakeHasher:
+    async def hash_many(self, passwords):
+        return [f'hash:{password}' for password in passwords]
+
+
+async def records(rows):
+    for line, row in enumerate(rows, start=1):
+        yield line, row
+
+
+def test_malformed_row_is_reported_next_to_valid_rows():
+    user_service = FakeUserService()
+    uow = SimpleNamespace(session=FakeSession(), role_service=FakeRoleService(), user_service=user_service)
+    use_cases = UserUseCases(uow, FakeHasher(), UserMapper(), None, None, None)
+    rows = [
+        {'full_name': 'Ivan Ivanovich Ivanov', 'email': 'first@example.com', 'password': 'password1'},
+        {'full_name': 'Petr Petrovich Petrov', 'email': 123, 'password': 'password2'},
+        {'full_name': 'Sidor Sidorovich Sidorov', 'email': 'second@example.com', 'password': 'password3'},
+    ]
+
+    report = asyncio.run(use_cases.import_users(records(rows), default_role='user'))
+
+    assert report.created == 2
+    assert report.failed == 1
+    assert [(error.line, error.email) for error in report.errors] == [(2, None)]
+    assert [record[2] for record in user_service.imported] == ['first@example.com', 'second@example.com']
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+async def collect(records):
+    return [record async for record in records]
+
+
+def test_invalid_utf8_line_is_reported_per_row():
+    body = b'{"email": "first@example.com"}\n{"email": "\xff"}\n{"email": "second@example.com"}\n'
+
+    records = asyncio.run(collect(iter_records(iter_lines(chunks(body[:20], body[20:])), NDJSON)))
+
+    assert records == [
+        (1, {'email': 'first@example.com'}),
+        (2, 'Invalid UTF-8'),
+        (3, {'email': 'second@example.com'}),
+    ]
+
+
+def test_csv_quoted_newline_stays_in_one_record():
+    body = b'full_name,email\n"First\nSecond Third",first@example.com\nIvan Ivanovich Ivanov,second@example.com\n'
+
+    records = asyncio.run(collect(iter_records(iter_lines(chunks(body)), CSV)))
+
+    assert records == [
+        (2, {'full_name': 'First\nSecond Third', 'email': 'first@example.com'}),
+        (4, {'full_name': 'Ivan Ivanovich Ivanov', 'email': 'second@example.com'}),
+    ]